@@ -0,0 +1,379 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import socketio
+from aiohttp import web
+
+from configcache import config_version
+from configdelta import apply_delta, ConfigDeltaError
+from pickjobs import PickJobEngine, parse_job_request
+from pinmap import PinMapError
+
+# Asyncio runtime of an agent. One event loop runs the HTTP API, the SocketIO
+# client, button input, the confirmation sender and the network check; agent
+# state (pin map, lit LEDs, jobs, configuration) is only touched on the loop.
+# Blocking hardware calls run in order on a single worker thread, database,
+# SQLite and HTTP calls on the loop's default executor.
+
+
+class AgentCore:
+    """Pick-by-light agent on one event loop.
+
+    The agent script supplies the hardware and the configuration source:
+      set_led(material, on), set_status_led(on)  drive the outputs
+      reconfigure(old_map, new_map)              switch the pins to a new map
+      compile_config(row)                        return the row with its 'pin_map'
+      fetch_configuration()                      read the row from MySQL ({} on failure)
+      set_leds(materials, on)                    optional batched switch, for /activate_leds and the
+                                                 slots a pick job is granted or releases at once
+    All of these hardware/database callables block and are never run on the loop.
+    Buttons arrive through button_threadsafe(position) from any thread, or from
+    a ButtonScanner polled by the core.
+    """
+
+    def __init__(self, hostname, device_id, config, version, *, set_led, set_status_led, reconfigure,
+                 compile_config, fetch_configuration, config_cache, outbox, monitor, server_url,
+                 set_leds=None, scanner=None, status=None, http_port=5000, max_body=64 * 1024,
+                 per_station=1):
+        self.hostname = hostname
+        self.device_id = device_id
+        self.config = config
+        self.version = version
+        self.pin_map = config['pin_map']
+        self.set_led = set_led
+        self.set_leds = set_leds
+        self.set_status_led = set_status_led
+        self.reconfigure = reconfigure
+        self.compile_config = compile_config
+        self.fetch_configuration = fetch_configuration
+        self.config_cache = config_cache
+        self.outbox = outbox
+        self.monitor = monitor
+        self.server_url = server_url
+        self.scanner = scanner
+        self.status = status  # Extra /status fields; called on the loop, must not block
+        self.http_port = http_port
+        self.max_body = max_body
+        self.lit = {material: False for material in self.pin_map.leds}
+        self.hardware = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hardware')
+        self.engine = PickJobEngine(self._engine_set_led, self._engine_confirm, per_station=per_station,
+                                    set_leds=self._engine_set_leds if set_leds is not None else None)
+        self.sio = socketio.AsyncClient()
+        self.sio.on('connect', self._sio_connect)
+        self.sio.on('configuration_update', self._configuration_update)
+        self.periodic = []  # (interval, blocking hardware function)
+        self.loop = None
+        self._config_lock = None
+        self._outbox_wakeup = None
+
+    # Called from GPIO callback threads and the hardware thread
+    def button_threadsafe(self, position):
+        if self.loop is None:
+            return  # Not running yet: no LED is lit, so the press would be ignored anyway
+        self.loop.call_soon_threadsafe(self.button_pressed, position)
+
+    def add_periodic(self, interval, function):
+        """Run a blocking hardware function every `interval` seconds (e.g. the latch verifier)."""
+        self.periodic.append((interval, function))
+
+    def hardware_call(self, function, *args):
+        return self.loop.run_in_executor(self.hardware, function, *args)
+
+    def hardware_submit(self, function, *args):
+        """Queue a blocking hardware call from any thread; its exception is printed, not lost."""
+        return self._report_errors(self.hardware.submit(function, *args), function.__name__)
+
+    @staticmethod
+    def _report_errors(future, what):
+        """Print the exception of a call nobody waits for instead of losing it."""
+        def done(f):
+            if not f.cancelled() and f.exception() is not None:
+                print(f"{what} failed: {f.exception()}")
+        future.add_done_callback(done)
+        return future
+
+    # Loop
+    def button_pressed(self, position):
+        material = self.pin_map.material_by_button.get(position)
+        # Only proceed if the LED for this material is currently on
+        if material is not None and self.lit.get(material):
+            self.engine.button_pressed(material)
+            self.engine.process_pending()
+
+    def _engine_set_led(self, material, on):
+        if material not in self.pin_map.leds:
+            return  # Removed by a configuration update while its job was waiting
+        self.lit[material] = on
+        # Ordered: one hardware thread
+        self._report_errors(self.hardware.submit(self.set_led, material, on),
+                            f"Switching the LED of {material} {'on' if on else 'off'}")
+
+    def _engine_set_leds(self, materials, on):
+        materials = [material for material in materials if material in self.pin_map.leds]
+        for material in materials:
+            self.lit[material] = on
+        self._report_errors(self.hardware.submit(self.set_leds, materials, on),
+                            f"Switching {len(materials)} LEDs {'on' if on else 'off'}")
+
+    def _engine_confirm(self, material, machine_name):
+        future = self.loop.run_in_executor(None, self.outbox.add, material, machine_name, self.hostname)
+        self._report_errors(future, f"Saving the confirmation of {material} to the outbox")
+        future.add_done_callback(lambda _: self._outbox_wakeup.set())
+
+    def _network_changed(self, online):
+        self._report_errors(self.hardware.submit(self.set_status_led, online), "Switching the status LED")
+        if online:
+            self._report_errors(self.loop.run_in_executor(None, self.outbox.retry_now),
+                                "Rescheduling the outbox")
+
+    async def run(self, revalidate=False):
+        self.loop = asyncio.get_running_loop()
+        self._config_lock = asyncio.Lock()
+        self._outbox_wakeup = asyncio.Event()
+        self.monitor.on_change = self._network_changed
+        if self.scanner is not None:
+            await self.hardware_call(self.scanner.prepare)
+
+        runner = web.AppRunner(self._web_app())
+        await runner.setup()
+        await web.TCPSite(runner, '0.0.0.0', self.http_port).start()
+        print(f"Agent API listening on port {self.http_port}.")
+
+        tasks = [self._sender(), self._health(), self._socketio()]
+        if self.scanner is not None:
+            tasks.append(self._scan())
+        if revalidate:
+            tasks.append(self._revalidate())
+        tasks += [self._every(interval, function) for interval, function in self.periodic]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            await runner.cleanup()
+            self.hardware.shutdown(wait=False)
+
+    # Tasks
+    async def _scan(self):
+        while True:
+            try:
+                await self.hardware_call(self.scanner.scan)
+                interval = self.scanner.next_interval()
+            except Exception as e:
+                print(f"Button scan failed: {e}")
+                interval = self.scanner.slow_interval
+            await asyncio.sleep(interval)
+
+    async def _sender(self):
+        while True:
+            try:
+                await self.loop.run_in_executor(None, self.outbox.send_due)
+                wait = await self.loop.run_in_executor(None, self.outbox.next_due_in)
+            except Exception as e:
+                # e.g. sqlite3.OperationalError; a failed round must not end the sender task
+                print(f"Confirmation sender error, retrying in {self.outbox.backoff:.0f} s: {e}")
+                wait = self.outbox.backoff
+            try:
+                await asyncio.wait_for(self._outbox_wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                continue
+            self._outbox_wakeup.clear()
+            if self.outbox.bulk_url and self.outbox.batch_window:
+                await asyncio.sleep(self.outbox.batch_window)  # Let the rest of a burst reach the outbox
+
+    async def _health(self):
+        monitor = self.monitor
+        while True:
+            ok = self.sio.connected or await self._probe()
+            online = monitor.update(ok)
+            await asyncio.sleep(monitor.interval_online if online else monitor.interval_offline)
+
+    async def _probe(self):
+        self.monitor.probes += 1
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(self.monitor.host, self.monitor.port),
+                                               self.monitor.timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
+
+    async def _socketio(self):
+        # After the first connection the client reconnects by itself
+        while not self.sio.connected:
+            try:
+                await self.sio.connect(self.server_url)
+                print("Connected to Flask server via SocketIO.")
+            except socketio.exceptions.ConnectionError as e:
+                print(f"Failed to connect to Flask server: {e}")
+                await asyncio.sleep(self.monitor.interval_online)
+        await self.sio.wait()
+
+    async def _revalidate(self, interval=30):
+        # After a boot without the database (from the cache or empty), check it until it answers
+        while True:
+            new_config = await self.loop.run_in_executor(None, self.fetch_configuration)
+            if new_config:
+                await self.apply_configuration(new_config)
+                return
+            await asyncio.sleep(interval)
+
+    async def _every(self, interval, function):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.hardware_call(function)
+            except Exception as e:
+                print(f"{function.__name__} failed: {e}")
+
+    # Configuration
+    async def _sio_connect(self):
+        await self.sio.emit('register_device', {'device_id': self.device_id, 'ip_address': self.config.get('ip_address'),
+                                                'hostname': self.hostname, 'version': self.version})
+
+    async def _configuration_update(self, data):
+        if not isinstance(data, dict) or 'version' not in data:
+            print("Configuration update without a delta, fetching it.")
+            await self.refresh_configuration()
+            return
+        if data['version'] == self.version:
+            return  # Repeated push of the version this agent already runs
+        print(f"Configuration update received: {self.version} -> {data['version']}")
+        async with self._config_lock:
+            try:
+                new_config = self.compile_config(apply_delta(self.config, self.version, data))
+            except (ConfigDeltaError, PinMapError) as err:
+                print(f"Cannot apply configuration update: {err}; fetching it.")
+                new_config = None
+            if new_config is not None:
+                await self._apply(new_config)
+                return
+        await self.refresh_configuration()
+
+    async def refresh_configuration(self):
+        new_config = await self.loop.run_in_executor(None, self.fetch_configuration)
+        if new_config:
+            await self.apply_configuration(new_config)
+        else:
+            print("Failed to fetch new configuration.")
+
+    async def apply_configuration(self, new_config):
+        async with self._config_lock:
+            await self._apply(new_config)
+
+    async def _apply(self, new_config):
+        if config_version(new_config) == self.version:
+            return
+        old_map, new_map = self.pin_map, new_config['pin_map']
+        if self.engine.cancel_materials(set(old_map.leds) - set(new_map.leds)):
+            self.engine.process_pending()
+        await self.hardware_call(self.reconfigure, old_map, new_map)
+        self.pin_map, self.config = new_map, new_config
+        self.lit = {material: self.lit.get(material, False) for material in new_map.leds}
+        self.version = await self.loop.run_in_executor(None, self.config_cache.save, new_config)
+        print(f"Configuration {self.version} applied.")
+
+    # HTTP API
+    def _web_app(self):
+        app = web.Application(client_max_size=self.max_body)
+        app.router.add_post('/activate_led', self._activate_led)
+        app.router.add_post('/deactivate_led', self._deactivate_led)
+        if self.set_leds is not None:
+            app.router.add_post('/activate_leds', self._activate_leds)
+        app.router.add_get('/jobs/{job_id:\\d+}', self._get_job)
+        app.router.add_delete('/jobs/{job_id:\\d+}', self._cancel_job)
+        app.router.add_get('/status', self._status)
+        app.router.add_get('/stations', self._stations)
+        return app
+
+    async def _json(self, request):
+        try:
+            data = await request.json()
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    # Create a pick job for the materials and return right away
+    async def _activate_led(self, request):
+        data = await self._json(request)
+        if data is None:
+            return web.json_response({'error': 'Invalid JSON body'}, status=400)
+        materials = data.get('materials', [])
+        machine_name = data.get('machine_name')
+        if not materials or not machine_name:
+            return web.json_response({'error': 'No materials or machine_name provided'}, status=400)
+        for material in materials:
+            if material not in self.pin_map.leds:
+                return web.json_response({'error': f'Invalid material: {material}'}, status=400)
+
+        try:
+            options = parse_job_request(data)
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+
+        job = self.engine.submit(materials, machine_name, **options)
+        self.engine.process_pending()
+        return web.json_response({'status': 'accepted', 'job_id': job.id, 'station': job.station,
+                                  'mode': job.mode}, status=202)
+
+    async def _stations(self, request):
+        return web.json_response(self.engine.station_stats())
+
+    # Switch the LEDs of a set of materials at once, without waiting for confirmation
+    async def _activate_leds(self, request):
+        data = await self._json(request)
+        materials = data.get('materials', []) if data else []
+        if not materials:
+            return web.json_response({'error': 'No materials provided'}, status=400)
+        for material in materials:
+            if material not in self.pin_map.leds:
+                return web.json_response({'error': f'Invalid material: {material}'}, status=400)
+
+        value = data.get('on', True)
+        if not isinstance(value, bool):
+            return web.json_response({'error': 'on must be true or false'}, status=400)
+        if not value:
+            jobs = self.engine.deactivate_all(materials)
+            self.engine.process_pending()
+            return web.json_response({'status': 'LEDs updated', 'cancelled_jobs': [job.id for job in jobs]})
+        for material in materials:
+            self.lit[material] = True
+        writes = await self.hardware_call(self.set_leds, materials, True)
+        return web.json_response({'status': 'LEDs updated', 'spi_writes': writes})
+
+    async def _deactivate_led(self, request):
+        data = await self._json(request)
+        material = data.get('material') if data else None
+        if material in self.pin_map.leds:
+            # Through the engine, so the job holding the slot is cancelled and the slot freed
+            job = self.engine.deactivate(material)
+            self.engine.process_pending()
+            return web.json_response({'status': 'LED deactivated', 'cancelled_job': job.id if job else None})
+        return web.json_response({'error': 'Invalid material'}, status=400)
+
+    async def _get_job(self, request):
+        job = self.engine.get(int(request.match_info['job_id']))
+        if job is None:
+            return web.json_response({'error': 'Unknown job'}, status=404)
+        return web.json_response(job)
+
+    async def _cancel_job(self, request):
+        job_id = int(request.match_info['job_id'])
+        if self.engine.cancel(job_id) is None:
+            return web.json_response({'error': 'Unknown job'}, status=404)
+        self.engine.process_pending()
+        return web.json_response({'status': 'cancelling', 'job_id': job_id}, status=202)
+
+    async def _status(self, request):
+        pending = await self.loop.run_in_executor(None, self.outbox.pending)
+        body = {
+            'hostname': self.hostname,
+            'device_id': self.device_id,
+            'machine_name': self.pin_map.machine_name,
+            'config_version': self.version,
+            'runtime': 'asyncio',
+            'network': self.monitor.state(),
+            'confirmations_pending': pending,
+            'leds_on': [material for material, on in self.lit.items() if on],
+        }
+        if self.status is not None:
+            body.update(self.status())
+        return web.json_response(body)
@@ -0,0 +1,136 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from configcache import ConfigCache, device_id
+
+# Load benchmark of an agent's control API: concurrent clients, each on one
+# keep-alive session, create pick jobs, cancel them and poll /status.
+# With --agent the script starts that agent on the simulated I/O backend with
+# a generated configuration; otherwise it loads the agent already at --url.
+
+
+def sim_configuration(pins, materials):
+    if pins == 'mcp':
+        slots = [(chip, pin) for chip in range(4) for pin in range(8)][:materials]
+        leds = {f"MAT{i:03d}": {'chip': chip, 'pin': pin} for i, (chip, pin) in enumerate(slots)}
+        buttons = {f"MAT{i:03d}": {'chip': chip, 'pin': pin} for i, (chip, pin) in enumerate(slots)}
+        status_led_pin = 26
+    else:
+        count = min(materials, 12)
+        leds = {f"MAT{i:03d}": 2 + i for i in range(count)}
+        buttons = {f"MAT{i:03d}": 14 + i for i in range(count)}
+        status_led_pin = 27
+    return {'machine_name': 'BENCH', 'ip_address': '127.0.0.1', 'status_led_pin': status_led_pin,
+            'led_pins': leds, 'button_pins': buttons}
+
+
+def start_agent(script, pins, materials, url):
+    cache_dir = tempfile.mkdtemp(prefix='pbl-bench-')
+    cache_path = os.path.join(cache_dir, 'configuration.json')
+    ConfigCache(cache_path, device_id()).save(sim_configuration(pins, materials))
+    env = dict(os.environ, PBL_IO_BACKEND='sim', PBL_CONFIG_CACHE=cache_path)
+    agent = subprocess.Popen([sys.executable, script], env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{url}/status", timeout=1).status_code == 200:
+                return agent
+        except requests.RequestException:
+            pass
+        if agent.poll() is not None:
+            raise RuntimeError(f"{script} exited with {agent.returncode}")
+        time.sleep(0.2)
+    agent.terminate()
+    raise RuntimeError(f"{script} did not answer on {url}")
+
+
+def client(url, materials, deadline, latencies, errors):
+    # http.client keeps the client side cheap, so the numbers are the agent's
+    parsed = urlsplit(url)
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=5)
+
+    def call(method, path, body=None, label=None):
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                               headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            data = response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            ok, data = False, None
+        latencies.setdefault(label or path, []).append(time.perf_counter() - start)
+        if not ok:
+            errors.append(label or path)
+        return json.loads(data) if ok else None
+
+    while time.time() < deadline:
+        job = call('POST', '/activate_led', {'materials': [random.choice(materials)], 'machine_name': 'BENCH'})
+        if job is not None:
+            call('DELETE', f"/jobs/{job['job_id']}", label='/jobs/<id> DELETE')
+        call('GET', '/status')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark of the agent control API")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--agent', help="agent script to start on the simulated backend, e.g. codeforpbllast14mcp")
+    parser.add_argument('--pins', choices=('mcp', 'gpio'), default='mcp', help="pin layout of the generated configuration")
+    parser.add_argument('--materials', type=int, default=30)
+    parser.add_argument('--material', action='append', help="material to pick (repeatable) on an agent not started here")
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    agent = start_agent(args.agent, args.pins, args.materials, args.url) if args.agent else None
+    try:
+        materials = args.material or sorted(sim_configuration(args.pins, args.materials)['led_pins'])
+        deadline = time.time() + args.duration
+        per_client = [({}, []) for _ in range(args.clients)]
+        threads = [threading.Thread(target=client, args=(args.url, materials, deadline, latencies, errors))
+                   for latencies, errors in per_client]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        if agent is not None:
+            agent.terminate()
+            agent.wait()
+
+    by_path = {}
+    for latencies, _ in per_client:
+        for path, values in latencies.items():
+            by_path.setdefault(path, []).extend(values)
+    every = [v for values in by_path.values() for v in values]
+    failed = sum(len(errors) for _, errors in per_client)
+    print(f"{args.clients} clients, {elapsed:.1f} s, {len(every)} requests, {failed} errors, "
+          f"{len(every) / elapsed:.0f} req/s")
+    for path, values in sorted(by_path.items()) + [('all', every)]:
+        if values:
+            print(f"{path:<24} {len(values):8d} req  p50 {percentile(values, 0.5) * 1000:7.2f} ms  "
+                  f"p99 {percentile(values, 0.99) * 1000:7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
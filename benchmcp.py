@@ -0,0 +1,87 @@
+import argparse
+import time
+
+from iobackend import open_mcp23s17
+from mcp23s17 import MCP23S17Bus, IODIRA, IODIRB, GPPUA, PORT_A, PORT_B
+from buttonscanner import ButtonScanner
+from selftest import mcp_self_test
+
+# Off-device benchmark of the MCP23S17 driver on the simulated backend:
+# SPI traffic and time for lighting an order, scanning the bus and handling presses.
+
+CHIP_SELECT_PINS = [5, 6, 25, 24]
+MCP_INT_PIN = 22
+
+
+def open_rack(args):
+    if args.addressing == 'haen':
+        gpio, spi = open_mcp23s17('sim', addresses=list(range(args.chips)), int_pin=MCP_INT_PIN, latency=args.latency)
+        bus = MCP23S17Bus(spi, gpio, addresses=list(range(args.chips)))
+        bus.enable_hardware_addressing()
+    else:
+        gpio, spi = open_mcp23s17('sim', cs_pins=CHIP_SELECT_PINS[:args.chips], int_pin=MCP_INT_PIN, latency=args.latency)
+        bus = MCP23S17Bus(spi, gpio, cs_pins=CHIP_SELECT_PINS[:args.chips])
+    for chip in range(bus.chip_count):
+        bus.write_register(chip, IODIRA, 0xFF)
+        bus.write_register(chip, GPPUA, 0xFF)
+        bus.write_register(chip, IODIRB, 0x00)
+        bus.all_off(chip, PORT_B)
+    return gpio, spi, bus
+
+
+def measure(name, spi, gpio, action, repeat):
+    spi.reset_counters()
+    gpio_calls = gpio.calls
+    start = time.perf_counter()
+    for _ in range(repeat):
+        action()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {spi.transactions / repeat:8.1f} xfers {spi.bytes / repeat:8.1f} bytes "
+          f"{(gpio.calls - gpio_calls) / repeat:8.1f} gpio calls {elapsed / repeat * 1000:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MCP23S17 driver on the simulator")
+    parser.add_argument('--chips', type=int, default=4)
+    parser.add_argument('--addressing', choices=('cs', 'haen'), default='cs')
+    parser.add_argument('--materials', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every SPI transfer")
+    parser.add_argument('--repeat', type=int, default=100)
+    args = parser.parse_args()
+
+    gpio, spi, bus = open_rack(args)
+    positions = [(chip, PORT_B, pin) for chip in range(bus.chip_count) for pin in range(8)][:args.materials]
+
+    def light_one_by_one():
+        for chip, port, pin in positions:
+            bus.write_pin(chip, port, pin, True)
+        for chip, port, pin in positions:
+            bus.write_pin(chip, port, pin, False)
+
+    def light_batched():
+        bus.write_pins([(*position, True) for position in positions])
+        bus.write_pins([(*position, False) for position in positions])
+
+    masks = [0xFF] * bus.chip_count
+    scanner = ButtonScanner(bus, masks, on_press=lambda *a: None, press_samples=1, release_samples=1)
+
+    def press_and_scan():
+        spi.press(0, PORT_A, 3)
+        scanner.scan()
+        spi.release(0, PORT_A, 3)
+        scanner.scan()
+
+    print(f"{bus.chip_count} chips ({args.addressing}), {len(positions)} materials, "
+          f"{args.latency * 1e6:.0f} us simulated latency per transfer")
+    measure(f"light+clear {len(positions)} one by one", spi, gpio, light_one_by_one, args.repeat)
+    measure(f"light+clear {len(positions)} batched", spi, gpio, light_batched, args.repeat)
+    measure("press+release, bus scan", spi, gpio, press_and_scan, args.repeat)
+
+    led_masks = {}
+    for chip, port, pin in positions:
+        led_masks[(chip, port)] = led_masks.get((chip, port), 0) | 1 << pin
+    measure(f"self-test {len(positions)} LEDs", spi, gpio, lambda: mcp_self_test(bus, led_masks), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+
+import redis
+
+# Bump the generation and log the invalidated scope under it, atomically
+PUBLISH_INVALIDATION = """
+local generation = redis.call('incr', KEYS[1])
+redis.call('rpush', KEYS[2], generation .. '|' .. ARGV[1] .. '|' .. ARGV[2])
+redis.call('ltrim', KEYS[2], -tonumber(ARGV[3]), -1)
+return generation
+"""
+
+
+class BomCache:
+    """Two-tier cache of processed BOM levels (the direct components of one material).
+
+    Entries are keyed by (material, werks, stlan, stlal, datuv day) and live in
+    an in-process LRU in front of Redis. Both tiers expire an entry at the end
+    of its validity day, when lookups move on to the next DATUV anyway.
+
+    invalidate() drops matching entries from Redis and from this process, and
+    logs the (material, werks) scope in Redis under a new generation; other
+    processes replay the log within sync_interval seconds and drop only the
+    matching local entries. Only the level of the changed material has to be
+    invalidated: the levels above it only list it as a component.
+
+    A loader takes load_token() before asking SAP and hands it to put(); a
+    level whose load started before a matching invalidation is not stored.
+    """
+
+    def __init__(self, redis_client, max_entries=20000, prefix='bom:', sync_interval=5.0, log_size=1000):
+        self.redis = redis_client
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self.sync_interval = sync_interval
+        self.log_size = log_size  # Invalidations kept in Redis for processes that are behind
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.local = OrderedDict()  # key -> (expires, level), least recently used first
+        self.generation = None      # Last Redis generation applied here
+        self.epoch = 0              # Invalidations applied here, local or replayed
+        self.recent = deque(maxlen=256)  # (epoch, material, werks) of the latest invalidations
+        self.next_sync = 0.0
+        self.redis_ok = True
+        # Metrics
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    @staticmethod
+    def key(material, werks, stlan, stlal, datuv):
+        return (material, werks, str(stlan), str(stlal), datuv.isoformat())
+
+    def _redis_key(self, key):
+        material, werks, stlan, stlal, day = key
+        return f"{self.prefix}{werks}:{stlan}:{stlal}:{day}:{material}"
+
+    @staticmethod
+    def _expires(key):
+        # Wall-clock end of the validity day
+        day = datetime.strptime(key[4], '%Y-%m-%d')
+        return (day + timedelta(days=1)).timestamp()
+
+    def get(self, key):
+        """Return a copy of the cached level, or None on a miss."""
+        self._sync()
+        now = time.time()
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.local.move_to_end(key)
+                    self.local_hits += 1
+                    return list(entry[1])
+                del self.local[key]
+
+        cached = self._redis_call(self.redis.get, self._redis_key(key))
+        if cached is not None:
+            level = json.loads(cached)
+            with self.lock:
+                self.redis_hits += 1
+                self._store_local(key, level, self._expires(key))
+            return list(level)
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def load_token(self):
+        """Take before loading a level from SAP; pass to put()."""
+        return self.epoch
+
+    def put(self, key, level, token=None):
+        expires = self._expires(key)
+        ttl = int(expires - time.time())
+        if ttl <= 0:
+            return
+        if token is not None:
+            self._sync(force=True)  # See invalidations by other processes during the load
+        with self.lock:
+            if token is not None and self._invalidated_since(token, key):
+                self.stale_puts += 1
+                return
+            self.stores += 1
+            self._store_local(key, list(level), expires)
+        self._redis_call(self.redis.setex, self._redis_key(key), ttl, json.dumps(level))
+
+    def _store_local(self, key, level, expires):
+        # Holds self.lock
+        self.local[key] = (expires, level)
+        self.local.move_to_end(key)
+        while len(self.local) > self.max_entries:
+            self.local.popitem(last=False)
+            self.evictions += 1
+
+    @staticmethod
+    def _matches(key, material, werks):
+        return (material is None or key[0] == material) and (werks is None or key[1] == werks)
+
+    def _invalidated_since(self, token, key):
+        # Holds self.lock
+        if token < self.epoch - len(self.recent):
+            return True  # Too old to tell
+        return any(epoch > token and self._matches(key, material, werks)
+                   for epoch, material, werks in self.recent)
+
+    def _drop_local(self, material, werks):
+        # Holds self.lock
+        stale = [k for k in self.local if self._matches(k, material, werks)]
+        for k in stale:
+            del self.local[k]
+        self.epoch += 1
+        self.recent.append((self.epoch, material, werks))
+        return len(stale)
+
+    def invalidate(self, material=None, werks=None):
+        """Drop the cached levels of a material and/or plant (everything when both are None).
+
+        Returns the number of Redis entries removed.
+        """
+        with self.lock:
+            dropped = self._drop_local(material, werks)
+            self.invalidations += 1
+
+        # Other processes replay the logged scope at their next sync
+        generation = self._redis_call(self.redis.eval, PUBLISH_INVALIDATION, 2,
+                                      f"{self.prefix}generation", f"{self.prefix}invalidations",
+                                      werks or '', material or '', self.log_size)
+        with self.lock:
+            if generation is not None and self.generation is not None and generation == self.generation + 1:
+                self.generation = generation  # Nothing else to replay
+
+        pattern = f"{self.prefix}{werks or '*'}:*:*:*:{material or '*'}"
+        removed = 0
+        keys = self._redis_call(lambda: list(self.redis.scan_iter(match=pattern, count=500))) or []
+        for start in range(0, len(keys), 500):
+            removed += self._redis_call(self.redis.delete, *keys[start:start + 500]) or 0
+        logging.info(f"BOM cache invalidated (material={material}, werks={werks}): "
+                     f"{dropped} local, {removed} Redis entries")
+        return removed
+
+    def _sync(self, force=False):
+        # Replay the invalidations other processes logged since the last sync
+        now = time.monotonic()
+        if not force and now < self.next_sync:
+            return
+        with self.sync_lock:
+            self.next_sync = now + self.sync_interval
+            generation = self._redis_call(self.redis.get, f"{self.prefix}generation")
+            if generation is None and not self.redis_ok:
+                return
+            generation = int(generation or 0)
+            if self.generation is None or generation == self.generation:
+                self.generation = generation
+                return
+
+            entries = []
+            for entry in self._redis_call(self.redis.lrange, f"{self.prefix}invalidations", 0, -1) or []:
+                entry_generation, werks, material = entry.decode().split('|', 2)
+                entries.append((int(entry_generation), material or None, werks or None))
+            with self.lock:
+                if not entries or entries[0][0] > self.generation + 1:
+                    self._drop_local(None, None)  # The log no longer reaches back far enough
+                else:
+                    for entry_generation, material, werks in entries:
+                        if entry_generation > self.generation:
+                            self._drop_local(material, werks)
+                self.generation = max([generation] + [e[0] for e in entries])
+
+    def _redis_call(self, function, *args):
+        # Redis is the shared tier only; without it the local tier keeps working
+        try:
+            result = function(*args)
+        except redis.RedisError as e:
+            if self.redis_ok:
+                logging.warning(f"BOM cache: Redis unavailable, using the local tier only: {e}")
+            self.redis_ok = False
+            return None
+        if not self.redis_ok:
+            logging.info("BOM cache: Redis is back")
+        self.redis_ok = True
+        return result
+
+    def stats(self):
+        with self.lock:
+            lookups = self.local_hits + self.redis_hits + self.misses
+            return {
+                'entries': len(self.local),
+                'max_entries': self.max_entries,
+                'local_hits': self.local_hits,
+                'redis_hits': self.redis_hits,
+                'misses': self.misses,
+                'hit_rate': (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'stale_puts': self.stale_puts,
+                'redis_ok': self.redis_ok,
+            }
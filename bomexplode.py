@@ -0,0 +1,98 @@
+import logging
+import time
+
+
+class BomExplosion:
+    """Level-by-level BOM explosion for one request.
+
+    fetch_level(material, werks) returns the direct components of a material
+    ([{'Material', 'Description', 'Quantity'}, ...]). run_batch(function,
+    arguments, timeout) runs it for a list of argument tuples in parallel and
+    returns the results in order (e.g. BoundedExecutor.run_all).
+
+    Every distinct material is fetched once per explosion, however many
+    parents it has, one batch per depth. At most max_depth levels are
+    fetched below each root, the root's own BOM being the first. A component
+    that is also one of its own ancestors is logged and not expanded again.
+
+    result(material) gives the flattened list the recursive fetch_bom_data()
+    used to build: the material's own level followed by the flattened
+    explosion of each expandable component, in the order they first appear.
+    The lists are shared between callers and must not be modified.
+    """
+
+    def __init__(self, fetch_level, run_batch, werks, max_depth=10, batch_size=64, expandable=None):
+        self.fetch_level = fetch_level
+        self.run_batch = run_batch
+        self.werks = werks
+        self.max_depth = max_depth
+        self.batch_size = batch_size
+        self.expandable = expandable or (lambda item: True)
+        self.levels = {}     # material -> its direct components
+        self.children = {}   # material -> its expandable components, first-seen order
+        self.flattened = {}  # material -> result(material)
+        self.fetches = 0
+        self.depth = 0
+        self.cycles = []     # (parent, component) edges that were cut
+        self.truncated = []  # Materials left unexpanded at max_depth
+
+    def explode(self, materials, timeout=None):
+        """Fetch every level below materials, breadth first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        roots = list(dict.fromkeys(materials))
+        frontier = [m for m in roots if m not in self.levels]
+        depth = 0
+        while frontier:
+            if depth >= self.max_depth:
+                logging.warning(f"BOM explosion stopped at depth {self.max_depth}, "
+                                f"not expanding: {', '.join(frontier)}")
+                self.truncated.extend(frontier)
+                break
+            for start in range(0, len(frontier), self.batch_size):
+                batch = frontier[start:start + self.batch_size]
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                levels = self.run_batch(self.fetch_level, [(m, self.werks) for m in batch], remaining)
+                self.fetches += len(batch)
+                for material, level in zip(batch, levels):
+                    level = level or []
+                    self.levels[material] = level
+                    self.children[material] = list(dict.fromkeys(
+                        item["Material"] for item in level if self.expandable(item)))
+            next_frontier = {}
+            for material in frontier:
+                for child in self.children[material]:
+                    if child not in self.levels:
+                        next_frontier[child] = None
+            frontier = list(next_frontier)
+            depth += 1
+        self.depth = max(self.depth, depth)
+        self._break_cycles(roots)
+
+    def _break_cycles(self, roots):
+        on_path, finished = set(), set()
+
+        def visit(material):
+            on_path.add(material)
+            for child in list(self.children.get(material, ())):
+                if child in on_path:
+                    logging.warning(f"BOM cycle: {child} is a component of its own sub-assembly {material}, "
+                                    f"not expanded again")
+                    self.children[material].remove(child)
+                    self.cycles.append((material, child))
+                elif child not in finished:
+                    visit(child)
+            on_path.discard(material)
+            finished.add(material)
+
+        for root in roots:
+            if root not in finished:
+                visit(root)
+
+    def result(self, material):
+        flattened = self.flattened.get(material)
+        if flattened is None:
+            flattened = list(self.levels.get(material, []))
+            for child in self.children.get(material, ()):
+                flattened.extend(self.result(child))
+            self.flattened[material] = flattened
+        return flattened
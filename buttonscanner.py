@@ -0,0 +1,170 @@
+import threading
+import time
+
+from mcp23s17 import GPIOA
+
+
+def bit_index(chip, port, pin):
+    """Position of an input in the packed bus bitmap (16 bits per chip, port A first)."""
+    return chip * 16 + port * 8 + pin
+
+
+class Debouncer:
+    """Counter-based debounce for every bit of a packed input bitmap.
+
+    A bit changes state only after press_samples (or release_samples)
+    consecutive samples disagree with its current state; any sample that
+    agrees again resets the count. Events carry the time of the first
+    sample of the run, i.e. when the contact actually closed or opened.
+    """
+
+    def __init__(self, press_samples=2, release_samples=3):
+        if press_samples < 1 or release_samples < 1:
+            raise ValueError("Debounce thresholds must be at least one sample")
+        self.press_samples = press_samples
+        self.release_samples = release_samples
+        self.stable = 0
+        self.pending = {}  # bit -> (samples seen, time of the first one)
+
+    def reset(self, bitmap):
+        self.stable = bitmap
+        self.pending.clear()
+
+    def update(self, raw, ts):
+        """Feed one sample; return the list of (bit, pressed, ts) that became stable."""
+        events = []
+        differing = raw ^ self.stable
+        # Bits that bounced back to their stable level start over
+        for bit in [b for b in self.pending if not differing & b]:
+            del self.pending[bit]
+        while differing:
+            bit = differing & -differing
+            differing ^= bit
+            count, first_ts = self.pending.get(bit, (0, ts))
+            count += 1
+            pressed = bool(raw & bit)
+            if count >= (self.press_samples if pressed else self.release_samples):
+                self.stable ^= bit
+                self.pending.pop(bit, None)
+                events.append((bit, pressed, first_ts))
+            else:
+                self.pending[bit] = (count, first_ts)
+        return events
+
+    @property
+    def settling(self):
+        return bool(self.pending)
+
+
+class ButtonScanner:
+    """Read every chip's inputs in one burst per chip and report presses and releases.
+
+    Buttons are active-low. on_press/on_release are called with (chip, port, pin, ts)
+    from the scanner thread, after debouncing. The scan runs every fast_interval
+    while is_busy() is true (an LED is lit) or an input is settling, and every
+    slow_interval otherwise.
+    """
+
+    def __init__(self, bus, input_masks, on_press, on_release=None, is_busy=None,
+                 fast_interval=0.005, slow_interval=0.1,
+                 press_samples=2, release_samples=3):
+        self.bus = bus
+        self.input_masks = list(input_masks)  # 16-bit mask of button inputs per chip
+        self.on_press = on_press
+        self.on_release = on_release
+        self.is_busy = is_busy or (lambda: True)
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.debouncer = Debouncer(press_samples, release_samples)
+        self.lock = threading.Lock()  # Interrupt handlers may sample from several threads
+        self.scans = 0
+        self._thread = None
+
+    def read_bitmap(self):
+        bitmap = 0
+        for chip, mask in enumerate(self.input_masks):
+            if mask:
+                levels = self.bus.read_port_pair(chip, GPIOA)
+                bitmap |= (~levels & mask) << (chip * 16)
+        return bitmap
+
+    def read_captured(self):
+        """Bitmap with the flagged inputs as INTCAP captured them at the edge, or None if none is flagged.
+
+        Inputs that did not interrupt keep their debounced state.
+        """
+        bitmap, flagged = self.debouncer.stable, 0
+        for chip, mask in enumerate(self.input_masks):
+            if mask:
+                flags, captured = self.bus.read_interrupt(chip)
+                flags = (flags & mask) << (chip * 16)
+                bitmap = bitmap & ~flags | (~captured << (chip * 16)) & flags
+                flagged |= flags
+        return bitmap if flagged else None
+
+    @property
+    def pressed(self):
+        """Packed bitmap of the buttons currently held (debounced)."""
+        return self.debouncer.stable
+
+    def scan(self):
+        """Scan the bus once and emit events for every input whose debounced state changed."""
+        self._sample(self.read_bitmap)
+
+    def _sample(self, read):
+        with self.lock:
+            bitmap = read()
+            if bitmap is None:
+                return
+            self.scans += 1
+            events = self.debouncer.update(bitmap, time.time())
+        for bit, pressed, ts in events:
+            index = bit.bit_length() - 1
+            chip, rest = divmod(index, 16)
+            port, pin = divmod(rest, 8)
+            if pressed:
+                self.on_press(chip, port, pin, ts)
+            elif self.on_release:
+                self.on_release(chip, port, pin, ts)
+
+    def prepare(self):
+        """Enable burst reads and take the current levels as released (buttons held at start-up are not presses)."""
+        for chip, mask in enumerate(self.input_masks):
+            if mask:
+                self.bus.enable_sequential(chip)
+        self.debouncer.reset(self.read_bitmap())
+
+    def settle(self):
+        """Sample the levels captured at the interrupt, then scan until no input is settling.
+
+        Interrupt mode calls this after the INT line fell. The INTCAP sample
+        counts towards the debounce, so a press is seen from the edge on, and
+        the live scans that follow make a bouncing contact give one press, as
+        in scan mode. A tap already released by the first live scan is still
+        dropped, like any pulse shorter than press_samples.
+        """
+        self._sample(self.read_captured)
+        self.scan()
+        while self.debouncer.settling:
+            time.sleep(self.fast_interval)
+            self.scan()
+
+    def next_interval(self):
+        busy = self.debouncer.settling or self.is_busy()
+        return self.fast_interval if busy else self.slow_interval
+
+    def start(self):
+        if self._thread is None:
+            self.prepare()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.scan()
+                interval = self.next_interval()
+            except Exception as e:
+                print(f"Button scan failed: {e}")
+                interval = self.slow_interval
+            time.sleep(interval)
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import time
+
+
+def device_id():
+    """Stable id of this Pi: the CPU serial, else /etc/machine-id, else the hostname."""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('Serial'):
+                    serial = line.split(':', 1)[1].strip()
+                    if serial.strip('0'):
+                        return f"pi-{serial}"
+    except OSError:
+        pass
+    try:
+        with open('/etc/machine-id') as f:
+            machine_id = f.read().strip()
+            if machine_id:
+                return f"machine-{machine_id}"
+    except OSError:
+        pass
+    return f"host-{socket.gethostname()}"
+
+
+def local_ip_towards(host, port=3306):
+    """IP of the interface that routes to `host`; a UDP connect sends no packet."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect((host, port))
+        return s.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+    finally:
+        s.close()
+
+
+# Columns holding material -> pin JSON; hashed parsed, so JSON text and dicts give the same version
+PIN_FIELDS = ('led_pins', 'button_pins')
+
+
+def parse_pins(value):
+    if isinstance(value, (str, bytes)):
+        return json.loads(value) if value else {}
+    return dict(value or {})
+
+
+def config_version(config):
+    """Content hash of a configuration row, the same on every device and every boot."""
+    row = {k: v for k, v in config.items() if k != 'pin_map'}
+    for field in PIN_FIELDS:
+        if field in row:
+            try:
+                row[field] = parse_pins(row[field])
+            except ValueError:
+                pass  # Invalid JSON is hashed as it is
+    canonical = json.dumps(row, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+class ConfigCache:
+    """Last good configuration row on disk, so the agent can start without the database."""
+
+    def __init__(self, path, device):
+        self.path = path
+        self.device = device
+
+    def load(self):
+        """Return (config, version) from disk, or (None, None) if missing, corrupt or from another device."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        if data.get('device_id') != self.device or not isinstance(data.get('config'), dict):
+            return None, None
+        config = data['config']
+        if config_version(config) != data.get('version'):
+            print(f"Configuration cache {self.path} is damaged, ignoring it.")
+            return None, None
+        return config, data['version']
+
+    def save(self, config):
+        """Write the row atomically; returns its version."""
+        row = {k: v for k, v in config.items() if k != 'pin_map'}
+        version = config_version(row)
+        data = {'device_id': self.device, 'version': version, 'saved_at': time.time(), 'config': row}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.config-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, default=str)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return version
@@ -0,0 +1,64 @@
+import json
+
+from configcache import PIN_FIELDS, config_version, parse_pins
+
+# Versioned configuration deltas pushed to the agents over SocketIO.
+# The configuration server (port 5001, not in this tree) publishes them with
+# configpush.ConfigPublisher; the agents turn each 'configuration_update' payload
+# into a new row with apply_delta().
+#
+# Payload: {'base_version', 'version', 'set': {column: value}, 'removed': [column],
+#           'led_pins': {'set': {material: pin}, 'removed': [material]}, 'button_pins': {...}}
+# or, when the server does not know what the agent holds, {'version', 'config': row}.
+
+
+class ConfigDeltaError(ValueError):
+    """A pushed configuration cannot be applied to the row this agent holds."""
+
+
+def json_safe_row(row):
+    # Dates and decimals from MySQL travel as text, which config_version() hashes the same way
+    return json.loads(json.dumps({k: v for k, v in row.items() if k != 'pin_map'}, default=str))
+
+
+def config_delta(old, new):
+    """Delta that turns configuration row `old` into `new`."""
+    old, new = json_safe_row(old), json_safe_row(new)
+    delta = {'base_version': config_version(old), 'version': config_version(new),
+             'set': {k: v for k, v in new.items() if k not in PIN_FIELDS and old.get(k) != v},
+             'removed': [k for k in old if k not in new and k not in PIN_FIELDS]}
+    for field in PIN_FIELDS:
+        old_pins, new_pins = parse_pins(old.get(field)), parse_pins(new.get(field))
+        delta[field] = {'set': {m: p for m, p in new_pins.items() if old_pins.get(m) != p},
+                        'removed': [m for m in old_pins if m not in new_pins]}
+    return delta
+
+
+def apply_delta(config, version, delta):
+    """Return the row that `delta` makes of `config` (at `version`).
+
+    Raises ConfigDeltaError on a version gap or when the result does not hash
+    to the version the server announced; the agent then fetches the whole row.
+    """
+    if 'config' in delta:
+        row = dict(delta['config'])
+    else:
+        if delta.get('base_version') != version:
+            raise ConfigDeltaError(f"delta is based on {delta.get('base_version')}, this agent has {version}")
+        row = {k: v for k, v in config.items() if k != 'pin_map'}
+        row.update(delta.get('set', {}))
+        for key in delta.get('removed', []):
+            row.pop(key, None)
+        for field in PIN_FIELDS:
+            change = delta.get(field) or {}
+            try:
+                pins = parse_pins(row.get(field))
+            except ValueError as e:
+                raise ConfigDeltaError(f"{field} of the current row is not valid JSON: {e}") from None
+            pins.update(change.get('set', {}))
+            for material in change.get('removed', []):
+                pins.pop(material, None)
+            row[field] = pins
+    if config_version(row) != delta.get('version'):
+        raise ConfigDeltaError(f"result does not match version {delta.get('version')}")
+    return row
@@ -0,0 +1,53 @@
+import threading
+
+from flask_socketio import join_room
+
+from configcache import config_version
+from configdelta import config_delta, json_safe_row
+
+# Sending side of the configuration deltas applied by the agents (see configdelta.py).
+# The configuration server (port 5001) creates one ConfigPublisher(socketio) and calls
+# publish() after an admin edit instead of notifying every agent to re-read MySQL.
+
+
+class ConfigPublisher:
+    """Server side: push configuration changes to each agent in its own room, 'device:<device_id>'.
+
+    socketio is the server's flask_socketio.SocketIO. Agents emit 'register_device'
+    {'device_id', 'ip_address', 'version'} once connected. publish(ip_address, row)
+    sends the delta from the row last pushed to that agent (or `previous`), or the
+    whole row when the agent holds a version the server has no row for.
+    """
+
+    def __init__(self, socketio):
+        self.socketio = socketio
+        self.lock = threading.Lock()
+        self.devices = {}   # ip_address -> device_id
+        self.versions = {}  # device_id -> version the agent holds
+        self.rows = {}      # device_id -> last row pushed
+        socketio.on_event('register_device', self._register)
+
+    def _register(self, data):
+        device = (data or {}).get('device_id')
+        if not device:
+            return
+        join_room(f"device:{device}")
+        with self.lock:
+            self.devices[data.get('ip_address')] = device
+            self.versions[device] = data.get('version')
+
+    def publish(self, ip_address, row, previous=None):
+        """Push the new row of the agent at ip_address; returns False if that agent is not connected."""
+        with self.lock:
+            device = self.devices.get(ip_address)
+            if device is None:
+                return False
+            base = previous if previous is not None else self.rows.get(device)
+            if base is not None and config_version(base) == self.versions.get(device):
+                payload = config_delta(base, row)
+            else:
+                payload = {'version': config_version(row), 'config': json_safe_row(row)}
+            self.rows[device] = json_safe_row(row)
+            self.versions[device] = payload['version']
+        self.socketio.emit('configuration_update', payload, to=f"device:{device}")
+        return True
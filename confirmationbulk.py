@@ -0,0 +1,53 @@
+from collections import OrderedDict
+import threading
+
+from flask import request, jsonify
+
+# Receiving side of the bulk confirmation protocol used by ConfirmationOutbox.
+# The confirmation server (port 5001) calls register_bulk_confirmation(app, confirm)
+# with the function its /confirmation_material route already uses for one pick.
+
+
+def register_bulk_confirmation(app, confirm_material, remember=100000):
+    """Add POST /confirmation_materials to a Flask app.
+
+    The body is {'confirmations': [{'event_id', 'material', 'machine_name', 'hostname', 'ts'}, ...]};
+    confirm_material(material, machine_name, hostname, ts) is called once per new
+    event_id and the reply lists the accepted ids. Ids seen before are accepted
+    again without calling confirm_material, so retries are harmless.
+    """
+    seen = OrderedDict()
+    lock = threading.Lock()
+
+    @app.route('/confirmation_materials', methods=['POST'])
+    def confirmation_materials():
+        data = request.get_json(silent=True) or {}
+        confirmations = data.get('confirmations')
+        if not isinstance(confirmations, list):
+            return jsonify({'error': 'No confirmations provided'}), 400
+
+        accepted, rejected = [], []
+        for item in confirmations:
+            event_id = item.get('event_id') if isinstance(item, dict) else None
+            if not event_id or not item.get('material'):
+                rejected.append(event_id)
+                continue
+            with lock:
+                duplicate = event_id in seen
+                seen[event_id] = True  # Claimed before confirming, so a concurrent retry is not applied twice
+                while len(seen) > remember:
+                    seen.popitem(last=False)
+            if not duplicate:
+                try:
+                    confirm_material(item['material'], item.get('machine_name'), item.get('hostname'), item.get('ts'))
+                except Exception as e:
+                    print(f"Error confirming {item['material']} ({event_id}): {e}")
+                    with lock:
+                        seen.pop(event_id, None)
+                    rejected.append(event_id)
+                    continue
+            accepted.append(event_id)
+
+        return jsonify({'accepted': accepted, 'rejected': rejected}), 200
+
+    return confirmation_materials
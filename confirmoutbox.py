@@ -0,0 +1,169 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class ConfirmationOutbox:
+    """Durable, at-least-once delivery of confirmed picks to the server.
+
+    add() appends the confirmation to a local SQLite outbox (WAL mode) and
+    returns at once; a background sender posts the entries over a pooled
+    keep-alive session and deletes each one only after the server accepted
+    it. Every entry carries an event_id so the server can drop duplicates
+    after a retry.
+
+    With bulk_url set, the sender waits batch_window seconds after the first
+    new confirmation and sends everything due in one request
+    ({'confirmations': [...]}, answered with {'accepted': [event_id, ...]}).
+    If the server has no bulk endpoint (404/405) it falls back to one POST each.
+    """
+
+    def __init__(self, path, url, bulk_url=None, batch_window=0.25, timeout=(3, 5),
+                 backoff=1.0, max_backoff=300.0, batch=50):
+        self.url = url
+        self.bulk_url = bulk_url
+        self.batch_window = batch_window
+        self.timeout = timeout  # (connect, read) seconds
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.batch = batch
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                               event_id TEXT PRIMARY KEY,
+                               payload TEXT NOT NULL,
+                               created REAL NOT NULL,
+                               attempts INTEGER NOT NULL DEFAULT 0,
+                               next_attempt REAL NOT NULL)''')
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.sent = 0
+        self.failures = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def add(self, material, machine_name, hostname):
+        now = time.time()
+        event_id = uuid.uuid4().hex
+        payload = {'event_id': event_id, 'material': material, 'machine_name': machine_name,
+                   'hostname': hostname, 'ts': now}
+        with self.lock:
+            self.db.execute('INSERT INTO outbox (event_id, payload, created, next_attempt) VALUES (?, ?, ?, ?)',
+                            (event_id, json.dumps(payload), now, now))
+        self.wakeup.set()
+        return event_id
+
+    def retry_now(self):
+        """Send everything waiting without finishing the backoff (e.g. once the network is back)."""
+        with self.lock:
+            self.db.execute('UPDATE outbox SET next_attempt = ?', (time.time(),))
+        self.wakeup.set()
+
+    def pending(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def _due(self):
+        with self.lock:
+            return self.db.execute('SELECT event_id, payload, attempts FROM outbox WHERE next_attempt <= ? '
+                                   'ORDER BY created LIMIT ?', (time.time(), self.batch)).fetchall()
+
+    def next_due_in(self):
+        """Seconds until the next entry is due, or None when the outbox is empty."""
+        with self.lock:
+            row = self.db.execute('SELECT MIN(next_attempt) FROM outbox').fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def send_due(self):
+        """One round of the sender: post everything due now."""
+        due = self._due()
+        if due:
+            if self.bulk_url:
+                self._send_bulk(due)
+            else:
+                self._send_each(due)
+
+    def _run(self):
+        while True:
+            try:
+                self.send_due()
+                wait = self.next_due_in()
+            except Exception as e:
+                # e.g. sqlite3.OperationalError (database locked, disk full); keep the sender alive
+                print(f"Confirmation sender error, retrying in {self.backoff:.0f} s: {e}")
+                wait = self.backoff
+            woken = self.wakeup.wait(wait)
+            self.wakeup.clear()
+            if woken and self.bulk_url and self.batch_window:
+                time.sleep(self.batch_window)  # Let the rest of a burst reach the outbox
+
+    def _send_each(self, due):
+        for event_id, payload, attempts in due:
+            if self._post(json.loads(payload)):
+                self._delivered([event_id])
+            else:
+                # The rest of the batch waits for the next round
+                self._retry_later([(event_id, attempts)])
+                break
+
+    def _send_bulk(self, due):
+        payloads = [json.loads(payload) for _, payload, _ in due]
+        try:
+            response = self.session.post(self.bulk_url, json={'confirmations': payloads}, timeout=self.timeout)
+            if response.status_code in (404, 405):
+                print("Server has no bulk confirmation endpoint, sending one by one.")
+                self.bulk_url = None
+                self._send_each(due)
+                return
+            response.raise_for_status()
+            accepted = set(response.json().get('accepted', [p['event_id'] for p in payloads]))
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error sending {len(due)} confirmations: {e}")
+            accepted = set()
+        self._delivered([event_id for event_id, _, _ in due if event_id in accepted])
+        self._retry_later([(event_id, attempts) for event_id, _, attempts in due if event_id not in accepted])
+
+    def _delivered(self, event_ids):
+        if not event_ids:
+            return
+        with self.lock:
+            self.db.executemany('DELETE FROM outbox WHERE event_id = ?', [(e,) for e in event_ids])
+        self.sent += len(event_ids)
+
+    def _retry_later(self, entries):
+        if not entries:
+            return
+        now = time.time()
+        rows = []
+        for event_id, attempts in entries:
+            # Exponential backoff with jitter
+            delay = min(self.max_backoff, self.backoff * 2 ** attempts) * random.uniform(0.8, 1.2)
+            rows.append((now + delay, event_id))
+        with self.lock:
+            self.db.executemany('UPDATE outbox SET attempts = attempts + 1, next_attempt = ? '
+                                'WHERE event_id = ?', rows)
+        self.failures += len(entries)
+
+    def _post(self, payload):
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            return True
+        except requests.RequestException as e:
+            print(f"Error sending confirmation for {payload['material']}: {e}")
+            return False
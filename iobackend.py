@@ -0,0 +1,296 @@
+import threading
+import time
+
+from mcp23s17 import (IODIRA, IOCON, GPINTENA, DEFVALA, INTCONA, INTFA, INTCAPA,
+                      GPIOA, OLATA, IOCON_HAEN, IOCON_SEQOP, IOCON_MIRROR, PORT_A, PORT_B)
+
+# I/O backends for the agents:
+#   'hardware'  RPi.GPIO and spidev, imported only when selected
+#   'sim'       in-memory GPIO and MCP23S17 models, for benchmarks and tests on any Linux box
+
+BACKENDS = ('hardware', 'sim')
+
+
+def open_gpio(backend='hardware'):
+    """Return the GPIO module (or its simulated stand-in) for the agents that drive Pi pins directly."""
+    if backend == 'hardware':
+        import RPi.GPIO as GPIO
+        return GPIO
+    if backend == 'sim':
+        return SimulatedGPIO()
+    raise ValueError(f"Unknown I/O backend: {backend}")
+
+
+def open_mcp23s17(backend='hardware', cs_pins=None, addresses=None, int_pin=None,
+                  bus=0, device=0, speed_hz=1000000, latency=0.0):
+    """Return (gpio, spi) for an MCP23S17 rack.
+
+    With the simulator there is one simulated chip per chip-select pin, or
+    one per hardware address on the shared chip select; latency (seconds)
+    is added to every SPI transfer and int_pin receives the wired-OR INT lines.
+    """
+    if backend == 'hardware':
+        import RPi.GPIO as GPIO
+        import spidev
+        spi = spidev.SpiDev()
+        spi.open(bus, device)
+        spi.max_speed_hz = speed_hz
+        return GPIO, spi
+    if backend == 'sim':
+        gpio = SimulatedGPIO()
+        if addresses is not None:
+            chips = [SimulatedMCP23S17(address=address) for address in addresses]
+        else:
+            chips = [SimulatedMCP23S17(cs_pin=cs_pin) for cs_pin in cs_pins]
+        spi = SimulatedSpiDev(gpio, chips, latency=latency, int_pin=int_pin)
+        spi.open(bus, device)
+        spi.max_speed_hz = speed_hz
+        return gpio, spi
+    raise ValueError(f"Unknown I/O backend: {backend}")
+
+
+class SimulatedGPIO:
+    """The subset of RPi.GPIO used by the agents, with pins held in memory.
+
+    Scripts press buttons with press(channel)/release(channel); edge callbacks
+    run synchronously in the caller's thread.
+    """
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.mode = None
+        self.directions = {}
+        self.pulls = {}
+        self.outputs = {}
+        self.driven = {}  # Input channels pulled to a level from outside (buttons, INT lines)
+        self.callbacks = {}
+        self.calls = 0
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, channel, direction, pull_up_down=PUD_OFF, initial=None):
+        for ch in channel if isinstance(channel, (list, tuple)) else [channel]:
+            with self.lock:
+                self.calls += 1
+                self.directions[ch] = direction
+                self.pulls[ch] = pull_up_down
+                if direction == self.OUT:
+                    self.outputs[ch] = self.LOW if initial is None else initial
+
+    def output(self, channel, value):
+        with self.lock:
+            self.calls += 1
+            if self.directions.get(channel) != self.OUT:
+                raise RuntimeError(f"The GPIO channel {channel} has not been set up as an OUTPUT")
+            self.outputs[channel] = self.HIGH if value else self.LOW
+
+    def input(self, channel):
+        with self.lock:
+            self.calls += 1
+            return self._level(channel)
+
+    def _level(self, channel):
+        if self.directions.get(channel) == self.OUT:
+            return self.outputs[channel]
+        if channel in self.driven:
+            return self.driven[channel]
+        return self.LOW if self.pulls.get(channel) == self.PUD_DOWN else self.HIGH
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        with self.lock:
+            if channel in self.callbacks:
+                raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+            self.callbacks[channel] = (edge, callback)
+
+    def remove_event_detect(self, channel):
+        with self.lock:
+            self.callbacks.pop(channel, None)
+
+    def cleanup(self, channel=None):
+        with self.lock:
+            self.callbacks.clear()
+            self.driven.clear()
+
+    # Simulation hooks
+    def drive(self, channel, level):
+        """Drive an input from outside (None lets the pull resistor decide) and fire edge callbacks."""
+        with self.lock:
+            before = self._level(channel)
+            if level is None:
+                self.driven.pop(channel, None)
+            else:
+                self.driven[channel] = level
+            after = self._level(channel)
+            edge, callback = self.callbacks.get(channel, (None, None))
+        if callback is None or before == after:
+            return
+        if edge == self.BOTH or (edge == self.FALLING) == (after == self.LOW):
+            callback(channel)
+
+    def press(self, channel):
+        self.drive(channel, self.LOW)
+
+    def release(self, channel):
+        self.drive(channel, None)
+
+
+class SimulatedMCP23S17:
+    """Register file of one MCP23S17 (IOCON.BANK = 0) with buttons wired to ground."""
+
+    def __init__(self, address=0, cs_pin=None):
+        self.address = address
+        self.cs_pin = cs_pin  # None = on the kernel-managed chip select
+        self.registers = [0x00] * 0x16
+        self.registers[IODIRA] = self.registers[IODIRA + 1] = 0xFF
+        self.grounded = [0x00, 0x00]  # Pins currently pulled low by a pressed button
+
+    def responds_to(self, address):
+        if self.registers[IOCON] & IOCON_HAEN:
+            return address == self.address
+        return address == 0
+
+    def levels(self, port):
+        iodir = self.registers[IODIRA + port]
+        inputs = ~self.grounded[port] & 0xFF  # Pulled up (or floating high) unless grounded
+        return (inputs & iodir) | (self.registers[OLATA + port] & ~iodir & 0xFF)
+
+    def read(self, register):
+        port = register & 1
+        if register in (GPIOA, GPIOA + 1, INTCAPA, INTCAPA + 1):
+            value = self.levels(port) if register in (GPIOA, GPIOA + 1) else self.registers[register]
+            self.registers[INTFA + port] = 0x00  # Reading GPIO or INTCAP clears the interrupt
+            return value
+        if register == IOCON + 1:
+            register = IOCON
+        return self.registers[register]
+
+    def write(self, register, value):
+        if register in (INTFA, INTFA + 1, INTCAPA, INTCAPA + 1):
+            return  # Read-only
+        if register in (IOCON, IOCON + 1):
+            register = IOCON
+        if register in (GPIOA, GPIOA + 1):
+            register += OLATA - GPIOA  # Writing GPIO writes the latch
+        self.registers[register] = value & 0xFF
+
+    def set_button(self, port, pin, pressed):
+        before = self.levels(port)
+        if pressed:
+            self.grounded[port] |= 1 << pin
+        else:
+            self.grounded[port] &= ~(1 << pin)
+        after = self.levels(port)
+        enabled = self.registers[GPINTENA + port] & self.registers[IODIRA + port]
+        compare_defval = self.registers[INTCONA + port]
+        fired = ((before ^ after) & ~compare_defval) | ((after ^ self.registers[DEFVALA + port]) & compare_defval)
+        fired &= enabled
+        if fired:
+            if not self.registers[INTFA + port]:
+                self.registers[INTCAPA + port] = after
+            self.registers[INTFA + port] |= fired
+
+    def int_active(self, port):
+        if self.registers[IOCON] & IOCON_MIRROR:
+            return bool(self.registers[INTFA] or self.registers[INTFA + 1])
+        return bool(self.registers[INTFA + port])
+
+
+class SimulatedSpiDev:
+    """spidev.SpiDev stand-in that routes transfers to simulated MCP23S17 chips.
+
+    Counts transactions and bytes, sleeps `latency` seconds per transfer and
+    drives int_pin low while any chip has an interrupt pending (open-drain, wired-OR).
+    """
+
+    def __init__(self, gpio, chips, latency=0.0, int_pin=None):
+        self.gpio = gpio
+        self.chips = chips
+        self.latency = latency
+        self.int_pin = int_pin
+        self.max_speed_hz = 1000000
+        self.mode = 0
+        self.lock = threading.Lock()
+        self.transactions = 0
+        self.bytes = 0
+
+    def open(self, bus, device):
+        self.bus, self.device = bus, device
+
+    def close(self):
+        pass
+
+    def reset_counters(self):
+        self.transactions = 0
+        self.bytes = 0
+
+    def xfer2(self, data):
+        data = list(data)
+        with self.lock:
+            self.transactions += 1
+            self.bytes += len(data)
+            if self.latency:
+                time.sleep(self.latency)
+            result = self._transfer(data)
+        self._update_int_line()
+        return result
+
+    xfer = xfer2
+
+    def _selected_chips(self):
+        with self.gpio.lock:
+            return [chip for chip in self.chips
+                    if chip.cs_pin is None or self.gpio.outputs.get(chip.cs_pin) == self.gpio.LOW]
+
+    def _transfer(self, data):
+        result = [0x00] * len(data)
+        if len(data) < 2 or data[0] & 0xF0 != 0x40:
+            return result
+        address, reading, register = (data[0] >> 1) & 0x07, data[0] & 0x01, data[1]
+        chips = [chip for chip in self._selected_chips() if chip.responds_to(address)]
+        for chip in chips:
+            sequential = not chip.registers[IOCON] & IOCON_SEQOP
+            for i in range(2, len(data)):
+                offset = (i - 2) if sequential else 0
+                current = (register + offset) % len(chip.registers)
+                if reading:
+                    result[i] |= chip.read(current)
+                else:
+                    chip.write(current, data[i])
+        return result
+
+    def _update_int_line(self):
+        if self.int_pin is None:
+            return
+        active = any(chip.int_active(PORT_A) or chip.int_active(PORT_B) for chip in self.chips)
+        self.gpio.drive(self.int_pin, self.gpio.LOW if active else None)
+
+    # Simulation hooks
+    def press(self, chip, port, pin):
+        with self.lock:
+            self.chips[chip].set_button(port, pin, True)
+        self._update_int_line()
+
+    def release(self, chip, port, pin):
+        with self.lock:
+            self.chips[chip].set_button(port, pin, False)
+        self._update_int_line()
+
+    def latch(self, chip, port):
+        return self.chips[chip].registers[OLATA + port]
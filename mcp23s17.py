@@ -0,0 +1,250 @@
+import threading
+import time
+
+from spiqueue import SpiCommandQueue
+
+# MCP23S17 Register Addresses (IOCON.BANK = 0, port A and B registers are adjacent)
+IODIRA = 0x00    # Port A direction register (1=input, 0=output)
+IODIRB = 0x01    # Port B direction register (1=input, 0=output)
+IPOLA = 0x02     # Port A input polarity
+IPOLB = 0x03     # Port B input polarity
+GPINTENA = 0x04  # Port A interrupt-on-change enable
+GPINTENB = 0x05  # Port B interrupt-on-change enable
+DEFVALA = 0x06   # Port A default compare value
+DEFVALB = 0x07   # Port B default compare value
+INTCONA = 0x08   # Port A interrupt control (0=compare to previous value, 1=compare to DEFVAL)
+INTCONB = 0x09   # Port B interrupt control
+IOCON = 0x0A     # Configuration register (shared by both ports)
+GPPUA = 0x0C     # Port A pull-up resistors
+GPPUB = 0x0D     # Port B pull-up resistors
+INTFA = 0x0E     # Port A interrupt flags
+INTFB = 0x0F     # Port B interrupt flags
+INTCAPA = 0x10   # Port A state captured at the interrupt
+INTCAPB = 0x11   # Port B state captured at the interrupt
+GPIOA = 0x12     # Port A GPIO register
+GPIOB = 0x13     # Port B GPIO register
+OLATA = 0x14     # Port A output latch register
+OLATB = 0x15     # Port B output latch register
+
+# IOCON bits
+IOCON_BANK = 0x80    # Registers split by port (not used here)
+IOCON_MIRROR = 0x40  # INTA and INTB are internally connected
+IOCON_SEQOP = 0x20   # 1 = sequential operation disabled
+IOCON_DISSLW = 0x10  # Slew rate control on SDA disabled
+IOCON_HAEN = 0x08    # Hardware address pins enabled
+IOCON_ODR = 0x04     # INT pins are open-drain
+IOCON_INTPOL = 0x02  # INT pins active-high (ignored with ODR)
+
+PORT_A = 0
+PORT_B = 1
+
+# SPI opcodes: 0100 A2 A1 A0 R/W
+OPCODE_WRITE = 0x40
+OPCODE_READ = 0x41
+
+
+class MCP23S17Bus:
+    """MCP23S17 expanders sharing one SPI device.
+
+    Chips are either selected with one GPIO chip-select pin each (cs_pins), or
+    share the kernel-managed CE line and are told apart by their A2..A0 pins
+    (addresses, up to 8 chips with IOCON.HAEN set by enable_hardware_addressing()).
+    """
+
+    def __init__(self, spi, gpio, cs_pins=None, addresses=None):
+        if (cs_pins is None) == (addresses is None):
+            raise ValueError("Give either cs_pins or hardware addresses")
+        self.spi = spi
+        self.gpio = gpio
+        self.cs_pins = list(cs_pins) if cs_pins is not None else []
+        self.addresses = list(addresses) if addresses is not None else [0] * len(self.cs_pins)
+        if addresses is not None and (len(set(addresses)) != len(addresses) or any(not 0 <= a <= 7 for a in addresses)):
+            raise ValueError(f"Invalid MCP23S17 hardware addresses: {addresses}")
+        self.lock = threading.RLock()
+        self.queue = None  # SpiCommandQueue once start_queue() is called
+        # Shadow of the OLATA/OLATB latches of each chip, so LED changes need no read-back
+        self.latches = [[0x00, 0x00] for _ in self.addresses]
+        self.latch_mismatches = 0
+        # Per-pin polarity: a set bit means the output is active-low (LED on = latch bit cleared)
+        self.active_low = [[0x00, 0x00] for _ in self.addresses]
+
+        # Configure chip select pins as outputs and set them HIGH initially
+        for cs_pin in self.cs_pins:
+            gpio.setup(cs_pin, gpio.OUT)
+            gpio.output(cs_pin, gpio.HIGH)
+
+    @property
+    def chip_count(self):
+        return len(self.addresses)
+
+    def select_chip(self, chip):
+        """Set the specified chip's CS pin LOW and all others HIGH (-1 deselects all)."""
+        for i, cs_pin in enumerate(self.cs_pins):
+            self.gpio.output(cs_pin, self.gpio.LOW if i == chip else self.gpio.HIGH)
+
+    def _transfer(self, chip, data):
+        if not self.cs_pins:
+            return self.spi.xfer2(list(data))  # The kernel drives CE around the transfer
+        self.select_chip(chip)
+        try:
+            return self.spi.xfer2(list(data))
+        finally:
+            self.select_chip(-1)
+
+    def transfer(self, chip, data):
+        if self.queue is not None and not self.queue.in_worker():
+            return self.queue.submit(chip, data).result()
+        with self.lock:
+            return self._transfer(chip, data)
+
+    def start_queue(self):
+        """Hand the SPI device to a single worker thread (see spiqueue.py).
+
+        From then on register writes are queued without waiting and repeated
+        writes to the same register are merged; reads wait for their result.
+        """
+        if self.queue is None:
+            self.queue = SpiCommandQueue(self._transfer)
+            self.queue.start()
+        return self.queue
+
+    def flush(self):
+        if self.queue is not None:
+            self.queue.flush()
+
+    def enable_hardware_addressing(self):
+        """Set IOCON.HAEN on every chip on the shared chip select.
+
+        Until HAEN is set all chips answer to address 0, so one write to
+        address 0 reaches all of them at once. Some silicon revisions already
+        decode A2 with HAEN clear, so address 4 gets the same write.
+        """
+        with self.lock:
+            # No chip select to drive in this mode, so chip 0 only stands in for "the bus"
+            self.transfer(0, [OPCODE_WRITE, IOCON, IOCON_HAEN])
+            self.transfer(0, [OPCODE_WRITE | 4 << 1, IOCON, IOCON_HAEN])
+            for chip in range(self.chip_count):
+                iocon = self.read_register(chip, IOCON)
+                if not iocon & IOCON_HAEN:
+                    raise IOError(f"MCP23S17 at address {self.addresses[chip]} did not enable HAEN (read {iocon:#04x})")
+
+    def write_register(self, chip, register, value):
+        data = [OPCODE_WRITE | self.addresses[chip] << 1, register, value & 0xFF]
+        if self.queue is not None and not self.queue.in_worker():
+            # IOCON changes how the chip decodes what follows, so it is never merged or reordered
+            self.queue.submit(chip, data, key=None if register == IOCON else register)
+        else:
+            self.transfer(chip, data)
+
+    def read_register(self, chip, register):
+        return self.transfer(chip, [OPCODE_READ | self.addresses[chip] << 1, register, 0x00])[2]
+
+    def read_port_pair(self, chip, register):
+        """Read the A and B registers starting at `register` in one sequential burst.
+
+        Needs IOCON.SEQOP clear (the power-on default); returns (port_a << 0) | (port_b << 8).
+        """
+        result = self.transfer(chip, [OPCODE_READ | self.addresses[chip] << 1, register, 0x00, 0x00])
+        return result[2] | result[3] << 8
+
+    def read_registers(self, chip, register, count):
+        """Read `count` consecutive registers in one burst (IOCON.SEQOP clear)."""
+        return self.transfer(chip, [OPCODE_READ | self.addresses[chip] << 1, register] + [0x00] * count)[2:]
+
+    def enable_sequential(self, chip):
+        with self.lock:
+            iocon = self.read_register(chip, IOCON)
+            if iocon & IOCON_SEQOP:
+                self.write_register(chip, IOCON, iocon & ~IOCON_SEQOP)
+
+    # Output latches
+    def write_latch(self, chip, port, value):
+        with self.lock:
+            self.latches[chip][port] = value & 0xFF
+            self.write_register(chip, OLATA + port, value)
+
+    def set_active_low(self, chip, port, mask):
+        self.active_low[chip][port] = mask & 0xFF
+
+    def all_off(self, chip, port):
+        """Turn every output of a port off, honouring the polarity mask."""
+        self.write_latch(chip, port, self.active_low[chip][port])
+
+    def write_pin(self, chip, port, pin, value):
+        """Switch one output on or off with a single SPI write, using the shadow latch."""
+        self.write_pins([(chip, port, pin, value)])
+
+    def write_pins(self, changes):
+        """Apply many (chip, port, pin, on) changes with at most one write per port per chip.
+
+        Returns the number of register writes sent.
+        """
+        masks = {}
+        for chip, port, pin, value in changes:
+            on_mask, off_mask = masks.get((chip, port), (0, 0))
+            if value:
+                on_mask, off_mask = on_mask | (1 << pin), off_mask & ~(1 << pin)
+            else:
+                on_mask, off_mask = on_mask & ~(1 << pin), off_mask | (1 << pin)
+            masks[(chip, port)] = (on_mask, off_mask)
+
+        writes = 0
+        with self.lock:
+            for (chip, port), (on_mask, off_mask) in masks.items():
+                logical = (self.latches[chip][port] ^ self.active_low[chip][port]) | on_mask
+                logical &= ~off_mask
+                new_state = logical ^ self.active_low[chip][port]
+                if new_state != self.latches[chip][port]:
+                    self.write_latch(chip, port, new_state)
+                    writes += 1
+        return writes
+
+    def verify_latches(self):
+        """Read the latches back and rewrite any that drifted from the shadow (e.g. after a chip reset)."""
+        drifted = []
+        with self.lock:
+            for chip in range(self.chip_count):
+                for port in (PORT_A, PORT_B):
+                    actual = self.read_register(chip, OLATA + port)
+                    if actual != self.latches[chip][port]:
+                        drifted.append((chip, port, actual))
+                        self.write_register(chip, OLATA + port, self.latches[chip][port])
+        self.latch_mismatches += len(drifted)
+        return drifted
+
+    def start_latch_verifier(self, interval=30):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    for chip, port, actual in self.verify_latches():
+                        print(f"Latch of chip {chip} port {'AB'[port]} was {actual:#04x}, restored from shadow.")
+                except Exception as e:
+                    print(f"Latch verification failed: {e}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    # Interrupt-on-change
+    def enable_interrupts(self, chip, port, mask):
+        """Interrupt on any change of the masked pins of a port.
+
+        INTA/INTB are mirrored and open-drain so the INT lines of every chip
+        can share one Pi GPIO with a pull-up.
+        """
+        iocon = self.read_register(chip, IOCON)
+        self.write_register(chip, IOCON, iocon | IOCON_MIRROR | IOCON_ODR)
+        self.write_register(chip, INTCONA + port, 0x00)  # Compare against the previous value
+        self.write_register(chip, DEFVALA + port, 0x00)
+        self.write_register(chip, GPINTENA + port, mask)
+        self.read_register(chip, INTCAPA + port)  # Clear anything pending
+
+    def read_interrupt(self, chip):
+        """Return (flags, captured) of both ports, port A in the low byte.
+
+        INTFA..INTCAPB are adjacent, so one burst reads them all (IOCON.SEQOP
+        clear); reading INTCAP clears the interrupt.
+        """
+        flags_a, flags_b, captured_a, captured_b = self.read_registers(chip, INTFA, 4)
+        return flags_a | flags_b << 8, captured_a | captured_b << 8
@@ -0,0 +1,86 @@
+import socket
+import threading
+import time
+
+
+class NetworkMonitor:
+    """In-process health check of the server with hysteresis.
+
+    Each probe is a TCP connect to (host, port) with a short timeout; while
+    is_connected() reports a live SocketIO connection no probe is sent at all.
+    The state flips to offline after fail_threshold failed probes in a row and
+    back online after recover_threshold good ones. on_change(online) is called
+    on every flip, from the monitor's thread.
+    """
+
+    def __init__(self, host, port, on_change=None, is_connected=None, interval_online=5.0,
+                 interval_offline=1.0, timeout=1.0, fail_threshold=3, recover_threshold=2):
+        self.host = host
+        self.port = port
+        self.on_change = on_change
+        self.is_connected = is_connected
+        self.interval_online = interval_online
+        self.interval_offline = interval_offline
+        self.timeout = timeout
+        self.fail_threshold = fail_threshold
+        self.recover_threshold = recover_threshold
+        self.online = None  # Unknown until the first probe
+        self.since = time.time()
+        self.last_probe = None
+        self.probes = 0
+        self._streak = 0  # Consecutive probes disagreeing with the current state
+        self._stop = threading.Event()
+        self._thread = None
+
+    def probe(self):
+        if self.is_connected is not None and self.is_connected():
+            return True
+        self.probes += 1
+        try:
+            with socket.create_connection((self.host, self.port), timeout=self.timeout):
+                return True
+        except OSError:
+            return False
+
+    def check(self):
+        """Probe once and update the state; returns the (possibly unchanged) state."""
+        return self.update(self.probe())
+
+    def update(self, ok):
+        """Record the result of a probe made elsewhere (e.g. asynchronously); returns the state."""
+        self.last_probe = time.time()
+        if self.online is None:
+            self._set(ok)
+        elif ok != self.online:
+            self._streak += 1
+            if self._streak >= (self.recover_threshold if ok else self.fail_threshold):
+                self._set(ok)
+        else:
+            self._streak = 0
+        return self.online
+
+    def _set(self, online):
+        self.online = online
+        self.since = time.time()
+        self._streak = 0
+        print(f"Network to {self.host}:{self.port} is {'up' if online else 'down'}.")
+        if self.on_change:
+            self.on_change(online)
+
+    def state(self):
+        return {'online': self.online, 'since': self.since, 'last_probe': self.last_probe,
+                'probes': self.probes, 'host': self.host, 'port': self.port}
+
+    def run(self):
+        """Probe until stop() is called; the interval is shorter while offline."""
+        while not self._stop.is_set():
+            online = self.check()
+            self._stop.wait(self.interval_online if online else self.interval_offline)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
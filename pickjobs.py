@@ -0,0 +1,419 @@
+import itertools
+import queue
+import threading
+import time
+
+# Job states
+PENDING = 'pending'
+ACTIVE = 'active'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+# Pick modes
+SEQUENTIAL = 'sequential'  # One item lit at a time, in order
+PARALLEL = 'parallel'      # Every item lit, confirmed in any order
+WAVE = 'wave'              # The next wave_size items lit, in any order; then the next wave
+PICK_MODES = (SEQUENTIAL, PARALLEL, WAVE)
+DEFAULT_WAVE_SIZE = 3
+
+
+def parse_job_request(data):
+    """Scheduling fields of an /activate_led body, as keyword arguments for submit().
+
+    Raises ValueError with a message for the client.
+    """
+    # Orders of one station are picked in turn; different stations pick at once on different slots
+    station = data.get('station') or data.get('workstation_id') or data.get('machine_name')
+    priority = data.get('priority', 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        raise ValueError('priority must be an integer')
+
+    # 'sequential' (one by one), 'parallel' (all lit, any order) or 'wave' (wave_size at a time)
+    mode = data.get('mode', SEQUENTIAL)
+    wave_size = data.get('wave_size', DEFAULT_WAVE_SIZE)
+    if mode not in PICK_MODES or not isinstance(wave_size, int) or isinstance(wave_size, bool) or wave_size < 1:
+        raise ValueError(f'mode must be one of {", ".join(PICK_MODES)}, wave_size a positive integer')
+    return {'station': station, 'priority': priority, 'mode': mode, 'wave_size': wave_size}
+
+
+class PickJob:
+    """One order: a list of materials confirmed with the buttons, in the order the mode allows."""
+
+    def __init__(self, job_id, materials, machine_name, station=None, priority=0,
+                 mode=SEQUENTIAL, wave_size=DEFAULT_WAVE_SIZE):
+        if mode not in PICK_MODES:
+            raise ValueError(f"Unknown pick mode: {mode}")
+        if wave_size < 1:
+            raise ValueError("wave_size must be at least 1")
+        self.id = job_id
+        self.materials = list(materials)
+        self.machine_name = machine_name
+        self.station = station or machine_name
+        self.priority = priority
+        self.mode = mode
+        self.wave_size = wave_size
+        self.status = PENDING
+        self.done = set()  # Indexes of the confirmed items
+        self.held = set()  # Materials whose slot (LED and button) this job owns right now
+        self.lit_at = {}   # Item index -> time its LED was lit for this job
+        self.confirmed = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def open_items(self):
+        """Indexes of the items that may be picked now."""
+        if self.status not in (PENDING, ACTIVE):
+            return []
+        remaining = [i for i in range(len(self.materials)) if i not in self.done]
+        if not remaining or self.mode == PARALLEL:
+            return remaining
+        if self.mode == WAVE:
+            wave = remaining[0] // self.wave_size
+            return [i for i in remaining if i // self.wave_size == wave]
+        return remaining[:1]
+
+    def needed_materials(self):
+        """Materials of open items whose slot this job still has to be given, in item order."""
+        needed = []
+        for i in self.open_items():
+            material = self.materials[i]
+            if material not in self.held and material not in needed:
+                needed.append(material)
+        return needed
+
+    def current_material(self):
+        open_items = self.open_items() if self.status == ACTIVE else []
+        return self.materials[open_items[0]] if open_items else None
+
+    def to_dict(self):
+        open_materials = [self.materials[i] for i in self.open_items()]
+        return {
+            'job_id': self.id,
+            'machine_name': self.machine_name,
+            'station': self.station,
+            'priority': self.priority,
+            'mode': self.mode,
+            'wave_size': self.wave_size if self.mode == WAVE else None,
+            'status': self.status,
+            'materials': self.materials,
+            'current_material': self.current_material(),
+            'lit_materials': sorted(self.held),
+            'waiting_for_slot': self.status == ACTIVE and any(m not in self.held for m in open_materials),
+            'confirmed': self.confirmed,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'cycle_seconds': self.finished_at - self.started_at
+            if self.status == DONE and self.started_at else None,
+        }
+
+
+class Station:
+    """Queue statistics of one workstation or zone."""
+
+    def __init__(self, name):
+        self.name = name
+        self.last_served = 0  # Scheduler tick of the last slot granted, for round-robin between stations
+        self.started = 0
+        self.wait_total = 0.0
+        self.completed = 0
+        self.cycle_total = 0.0  # Seconds from start to the last confirmation, over completed jobs
+
+
+class PickJobEngine:
+    """Schedule pick jobs on the slots of one Pi and move them forward on button events.
+
+    A job lights its items one by one (sequential), all at once (parallel) or
+    wave_size at a time (wave); in the last two the lit items are confirmed in
+    any order and the job is done when every item is.
+
+    Every job belongs to a station (workstation or zone, the machine_name by
+    default); a station works on at most per_station jobs at a time and
+    queues the rest by priority, then arrival. A slot (a material's LED and
+    button) is owned by one job at a time, so stations pick concurrently on
+    different slots and a press is always credited to the slot's owner. When
+    several jobs need the same free slot the higher priority wins, then a job
+    already in progress, then the station served longest ago.
+
+    set_led(material, on) drives the hardware and on_confirm(material, machine_name)
+    reports a confirmed pick. The optional set_leds(materials, on) switches the
+    LEDs granted or released together in one go (one SPI write per expander
+    port) instead of one set_led() each. All of them are only ever called from
+    the engine thread (or the caller of process_pending()).
+    """
+
+    def __init__(self, set_led, on_confirm, keep_finished=200, per_station=1, set_leds=None):
+        self.set_led = set_led
+        self.set_leds = set_leds
+        self.on_confirm = on_confirm
+        self.keep_finished = keep_finished
+        self.per_station = per_station
+        self.jobs = {}
+        self.owners = {}    # material -> job holding its slot
+        self.stations = {}  # name -> Station
+        self.lock = threading.Lock()
+        self.events = queue.Queue()
+        self._ids = itertools.count(1)
+        self._ticks = itertools.count(1)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    # Called from the HTTP handlers and the button callbacks; never blocks
+    def submit(self, materials, machine_name, station=None, priority=0, mode=SEQUENTIAL,
+               wave_size=DEFAULT_WAVE_SIZE):
+        """Queue a job; raises ValueError for an unknown mode or wave size."""
+        with self.lock:
+            job = PickJob(next(self._ids), materials, machine_name, station, priority, mode, wave_size)
+            self.jobs[job.id] = job
+            if job.station not in self.stations:
+                self.stations[job.station] = Station(job.station)
+        self.events.put(('submit', job.id))
+        return job
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+        self.events.put(('cancel', job_id))
+        return job
+
+    def button_pressed(self, material):
+        self.events.put(('button', material))
+
+    def deactivate(self, material):
+        """Switch a material's LED off; the job owning its slot is cancelled, as it could never finish.
+
+        Returns the owning job at the time of the call, or None.
+        """
+        with self.lock:
+            job = self.owners.get(material)
+        self.events.put(('deactivate', [material]))
+        return job
+
+    def deactivate_all(self, materials):
+        """deactivate() for many materials, switched off together; returns the owning jobs."""
+        with self.lock:
+            jobs = {self.owners[m].id: self.owners[m] for m in materials if m in self.owners}
+        self.events.put(('deactivate', list(materials)))
+        return list(jobs.values())
+
+    def cancel_materials(self, materials):
+        """Cancel the unfinished jobs that need any of materials, e.g. ones a new configuration removes.
+
+        Such a job could never finish: the LED is gone and so is the button.
+        Returns the jobs cancelled.
+        """
+        materials = set(materials)
+        with self.lock:
+            jobs = [job for job in self.jobs.values()
+                    if job.status in (PENDING, ACTIVE) and materials.intersection(job.materials)]
+        for job in jobs:
+            print(f"Cancelling job {job.id} ({job.station}): "
+                  f"{', '.join(sorted(materials.intersection(job.materials)))} no longer configured.")
+            self.events.put(('cancel', job.id))
+        return jobs
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def active_materials(self):
+        """Materials whose LED is currently lit by a job."""
+        with self.lock:
+            return set(self.owners)
+
+    def station_stats(self):
+        """Queue depth and wait times per station."""
+        now = time.time()
+        with self.lock:
+            stats = {name: {'pending': 0, 'active': 0, 'waiting_for_slot': 0, 'oldest_wait': 0.0,
+                            'started': station.started, 'completed': station.completed,
+                            'avg_wait': station.wait_total / station.started if station.started else 0.0,
+                            'avg_cycle': station.cycle_total / station.completed if station.completed else 0.0}
+                     for name, station in self.stations.items()}
+            for job in self.jobs.values():
+                entry = stats[job.station]
+                if job.status == PENDING:
+                    entry['pending'] += 1
+                    entry['oldest_wait'] = max(entry['oldest_wait'], now - job.created_at)
+                elif job.status == ACTIVE:
+                    entry['active'] += 1
+                    entry['waiting_for_slot'] += bool(job.needed_materials())
+        for entry in stats.values():
+            entry['depth'] = entry['pending'] + entry['active']
+        return stats
+
+    def process_pending(self):
+        """Handle the queued events in the caller's thread, for an engine that is not start()ed."""
+        while True:
+            try:
+                kind, arg = self.events.get_nowait()
+            except queue.Empty:
+                return
+            self._handle(kind, arg)
+
+    # Engine thread
+    def _run(self):
+        while True:
+            kind, arg = self.events.get()
+            self._handle(kind, arg)
+
+    def _handle(self, kind, arg):
+        try:
+            if kind == 'submit':
+                self._apply([])
+            elif kind == 'cancel':
+                self._cancel_job(arg)
+            elif kind == 'button':
+                self._confirm(arg)
+            elif kind == 'deactivate':
+                self._deactivate(arg)
+        except Exception as e:
+            print(f"Pick job engine error on {kind} {arg}: {e}")
+
+    def _cancel_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status not in (PENDING, ACTIVE):
+                return
+            released = self._cancel_locked(job)
+        self._apply(released)
+        self._forget_old_jobs()
+
+    def _deactivate(self, materials):
+        cancelled, released = False, []
+        with self.lock:
+            for material in materials:
+                job = self.owners.get(material)
+                if job is None:
+                    released.append(material)  # Lit outside the jobs (e.g. /activate_leds), or already released
+                else:
+                    print(f"LED for {material} deactivated, cancelling job {job.id} ({job.station}).")
+                    released += self._cancel_locked(job)
+                    cancelled = True
+        self._apply(list(dict.fromkeys(released)))
+        if cancelled:
+            self._forget_old_jobs()
+
+    def _cancel_locked(self, job):
+        # Holds self.lock; returns the materials whose slots were released
+        job.status = CANCELLED
+        job.finished_at = time.time()
+        return self._release(job)
+
+    def _confirm(self, material):
+        with self.lock:
+            job = self.owners.get(material)
+            if job is None:
+                return
+            now = time.time()
+            index = next(i for i in job.open_items() if job.materials[i] == material)
+            job.done.add(index)
+            job.confirmed.append({'material': material, 'item': index, 'ts': now,
+                                  'pick_seconds': now - job.lit_at.get(index, now)})
+            if len(job.done) == len(job.materials):
+                job.status = DONE
+                job.finished_at = now
+                station = self.stations[job.station]
+                station.completed += 1
+                station.cycle_total += now - job.started_at
+            # Keep the slot while another open item of the job needs the same material
+            released = self._release(job, keep={job.materials[i] for i in job.open_items()})
+            self._mark_lit(job)
+        print(f"Confirmation received for {material} (job {job.id}, {job.station}).")
+        self.on_confirm(material, job.machine_name)
+        self._apply(released)
+        if job.status == DONE:
+            self._forget_old_jobs()
+
+    def _apply(self, released):
+        """Grant free slots, then switch only the LEDs whose owner state changed."""
+        with self.lock:
+            granted = self._schedule()
+        self._switch([material for material in released if material not in self.owners], False)
+        self._switch([material for material, _ in granted if material not in released], True)
+        for material, job in granted:
+            print(f"LED for {material} activated for job {job.id} ({job.station}). Waiting for confirmation.")
+
+    def _switch(self, materials, on):
+        if self.set_leds is not None and len(materials) > 1:
+            try:
+                self.set_leds(materials, on)
+                return
+            except Exception as e:
+                print(f"Could not switch {len(materials)} LEDs {'on' if on else 'off'} at once, "
+                      f"trying one by one: {e}")
+        for material in materials:
+            self._set_led(material, on)
+
+    def _set_led(self, material, on):
+        # One failing output must not keep the other granted slots dark
+        try:
+            self.set_led(material, on)
+        except Exception as e:
+            print(f"Could not switch the LED of {material} {'on' if on else 'off'}: {e}")
+
+    def _release(self, job, keep=()):
+        released = [material for material in job.held if material not in keep]
+        for material in released:
+            del self.owners[material]
+            job.held.discard(material)
+        return released
+
+    def _mark_lit(self, job):
+        now = time.time()
+        for i in job.open_items():
+            if job.materials[i] in job.held and i not in job.lit_at:
+                job.lit_at[i] = now
+
+    def _schedule(self):
+        """Give free slots to the jobs that need them; returns [(material, job)] granted. Holds self.lock."""
+        active = {}
+        for job in self.jobs.values():
+            if job.status == ACTIVE:
+                active[job.station] = active.get(job.station, 0) + 1
+        candidates = []
+        queued = {}
+        for job in sorted(self.jobs.values(), key=lambda j: (-j.priority, j.id)):
+            if not job.needed_materials():
+                continue
+            if job.status == PENDING:
+                # Only the head of each station's queue, up to its free capacity
+                free = self.per_station - active.get(job.station, 0) - queued.get(job.station, 0)
+                if free <= 0:
+                    continue
+                queued[job.station] = queued.get(job.station, 0) + 1
+            candidates.append(job)
+        candidates.sort(key=lambda j: (-j.priority, j.status != ACTIVE, self.stations[j.station].last_served, j.id))
+
+        granted = []
+        for job in candidates:
+            station = self.stations[job.station]
+            for material in job.needed_materials():
+                if material in self.owners:
+                    continue  # Slot busy: the job keeps its place for the next round
+                if job.status == PENDING:
+                    job.status = ACTIVE
+                    job.started_at = time.time()
+                    station.started += 1
+                    station.wait_total += job.started_at - job.created_at
+                self.owners[material] = job
+                job.held.add(material)
+                station.last_served = next(self._ticks)
+                granted.append((material, job))
+            self._mark_lit(job)
+        return granted
+
+    def _forget_old_jobs(self):
+        with self.lock:
+            finished = [job for job in self.jobs.values() if job.status in (DONE, CANCELLED)]
+            finished.sort(key=lambda j: j.finished_at)
+            for job in finished[:max(0, len(finished) - self.keep_finished)]:
+                del self.jobs[job.id]
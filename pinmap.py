@@ -0,0 +1,122 @@
+import json
+from types import MappingProxyType
+
+from mcp23s17 import PORT_A, PORT_B
+
+
+class PinMapError(ValueError):
+    """The led_pins/button_pins of a configuration cannot be used."""
+
+
+class PinMap:
+    """Read-only, validated index of a configuration's LED and button pins.
+
+    A pin is either a Pi GPIO channel (int) or an MCP23S17 position
+    (chip, port, pin). Built once per configuration by compile_pin_map().
+    """
+
+    __slots__ = ('machine_name', 'status_led_pin', 'leds', 'buttons',
+                 'material_by_button', 'led_masks', 'button_masks', 'active_low_masks')
+
+    def __init__(self, machine_name, status_led_pin, leds, buttons, active_low):
+        set_field = super().__setattr__
+        set_field('machine_name', machine_name)
+        set_field('status_led_pin', status_led_pin)
+        set_field('leds', MappingProxyType(dict(leds)))
+        set_field('buttons', MappingProxyType(dict(buttons)))
+        set_field('material_by_button', MappingProxyType({p: m for m, p in buttons.items()}))
+        set_field('led_masks', MappingProxyType(_port_masks(leds.values())))
+        set_field('button_masks', MappingProxyType(_port_masks(buttons.values())))
+        set_field('active_low_masks', MappingProxyType(_port_masks(leds[m] for m in active_low)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PinMap is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("PinMap is read-only")
+
+    def __repr__(self):
+        return f"PinMap({self.machine_name!r}, {len(self.leds)} LEDs, {len(self.buttons)} buttons)"
+
+    def materials(self):
+        return self.leds.keys()
+
+
+def _port_masks(positions):
+    """Per (chip, port) bitmask of the MCP23S17 positions; GPIO channels are skipped."""
+    masks = {}
+    for position in positions:
+        if isinstance(position, tuple):
+            chip, port, pin = position
+            masks[(chip, port)] = masks.get((chip, port), 0) | 1 << pin
+    return masks
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _parse_pins(raw, field, default_port, chip_count):
+    if isinstance(raw, (str, bytes)):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise PinMapError(f"{field} is not valid JSON: {e}") from None
+    if not isinstance(raw, dict):
+        raise PinMapError(f"{field} must map materials to pins, got {type(raw).__name__}")
+
+    pins, active_low, used = {}, [], {}
+    for material, entry in raw.items():
+        if _is_int(entry):
+            if not 0 <= entry <= 27:
+                raise PinMapError(f"{field}[{material}]: GPIO {entry} does not exist")
+            position = entry
+        elif isinstance(entry, dict):
+            chip = entry.get('chip', entry.get('expander'))
+            pin = entry.get('pin')
+            port = entry.get('port', default_port)
+            if not (_is_int(chip) and _is_int(pin) and port in (PORT_A, PORT_B)):
+                raise PinMapError(f"{field}[{material}]: expected chip/pin integers, got {entry}")
+            if not 0 <= pin <= 7 or not 0 <= chip < chip_count:
+                raise PinMapError(f"{field}[{material}]: chip {chip} pin {pin} is out of range")
+            position = (chip, port, pin)
+            if entry.get('active_low'):
+                active_low.append(material)
+        else:
+            raise PinMapError(f"{field}[{material}]: expected a GPIO number or chip/pin, got {entry!r}")
+        if position in used:
+            raise PinMapError(f"{field}: {material} and {used[position]} share pin {position}")
+        used[position] = material
+        pins[material] = position
+    return pins, active_low
+
+
+def compile_pin_map(config, led_port=PORT_B, button_port=PORT_A, chip_count=8):
+    """Validate a rasp_pi_configurations row and build its PinMap.
+
+    led_pins/button_pins may still be JSON text. Raises PinMapError on
+    malformed JSON, out-of-range pins, duplicates or a material without a button.
+    """
+    leds, active_low = _parse_pins(config.get('led_pins', {}), 'led_pins', led_port, chip_count)
+    buttons, _ = _parse_pins(config.get('button_pins', {}), 'button_pins', button_port, chip_count)
+    missing = sorted(set(leds) - set(buttons))
+    if missing:
+        raise PinMapError(f"No button configured for {', '.join(missing)}")
+    shared = set(leds.values()) & set(buttons.values())
+    if shared:
+        raise PinMapError(f"Pins used as both LED and button: {sorted(shared, key=str)}")
+    return PinMap(config.get('machine_name', ''), config.get('status_led_pin', 0), leds, buttons, active_low)
+
+
+def diff_pin_maps(old, new):
+    """Return (leds_added, leds_removed, buttons_added, buttons_removed), each material -> pin.
+
+    A material whose pin moved is in both the added and the removed dict;
+    materials that kept their pin are in neither. old may be None.
+    """
+    old_leds = old.leds if old is not None else {}
+    old_buttons = old.buttons if old is not None else {}
+    return ({m: p for m, p in new.leds.items() if old_leds.get(m) != p},
+            {m: p for m, p in old_leds.items() if new.leds.get(m) != p},
+            {m: p for m, p in new.buttons.items() if old_buttons.get(m) != p},
+            {m: p for m, p in old_buttons.items() if new.buttons.get(m) != p})
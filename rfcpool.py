@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(TimeoutError):
+    """No connection became free within the checkout timeout."""
+
+
+class _PooledConnection:
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+
+class RfcConnectionPool:
+    """Bounded pool of SAP RFC connections (pyrfc.Connection or anything with call/ping/close).
+
+    connect() opens a new, logged-on connection. A thread gets one connection
+    for itself; nested checkouts in the same thread (e.g. a recursive BOM
+    explosion) reuse it instead of taking a second one, so they cannot
+    deadlock on a full pool. Connections idle for more than max_idle or older
+    than max_lifetime are closed; one idle for more than check_after is pinged
+    before it is handed out. An exception of a discard_on type inside the
+    checkout closes the connection instead of returning it.
+    """
+
+    def __init__(self, connect, size=8, timeout=10.0, max_idle=300.0, max_lifetime=3600.0,
+                 check_after=60.0, discard_on=(Exception,)):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.discard_on = discard_on
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self.idle = []   # Free connections, most recently used last
+        self.open = 0    # Connections in use or idle
+        self.local = threading.local()
+        # Metrics
+        self.logons = 0
+        self.logon_time = 0.0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self.discarded = 0
+        self.evicted = 0
+        self.failed_checks = 0
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a with block."""
+        held = getattr(self.local, 'held', None)
+        if held is not None:
+            self.local.depth += 1
+            try:
+                yield held.connection
+            finally:
+                self.local.depth -= 1
+            return
+
+        pooled = self._checkout()
+        self.local.held, self.local.depth = pooled, 1
+        broken = False
+        try:
+            yield pooled.connection
+        except self.discard_on:
+            broken = True
+            raise
+        finally:
+            self.local.held = None
+            self._checkin(pooled, broken)
+
+    def call(self, function, **parameters):
+        with self.connection() as connection:
+            return connection.call(function, **parameters)
+
+    def _checkout(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self.lock:
+            self.checkouts += 1
+            self._evict_idle()
+            while not self.idle and self.open >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"No SAP connection free after {self.timeout:.1f} s ({self.size} in use)")
+                self.available.wait(remaining)
+            waited = time.monotonic() - start
+            if waited > 0.001:
+                self.waits += 1
+                self.wait_time += waited
+                self.max_wait = max(self.max_wait, waited)
+            pooled = self.idle.pop() if self.idle else None
+            if pooled is None:
+                self.open += 1  # Reserve the slot while logging on outside the lock
+
+        if pooled is not None and time.monotonic() - pooled.last_used > self.check_after:
+            try:
+                pooled.connection.ping()
+            except Exception as e:
+                # Its slot stays reserved for the replacement
+                logging.warning(f"Idle SAP connection failed its health check, replacing it: {e}")
+                self._close_quietly(pooled)
+                pooled = None
+                with self.lock:
+                    self.failed_checks += 1
+        if pooled is None:
+            pooled = self._logon()
+        return pooled
+
+    def _logon(self):
+        start = time.monotonic()
+        try:
+            connection = self.connect()
+        except Exception:
+            with self.lock:
+                self.open -= 1
+                self.available.notify()
+            raise
+        elapsed = time.monotonic() - start
+        with self.lock:
+            self.logons += 1
+            self.logon_time += elapsed
+        logging.info(f"SAP logon {self.logons} took {elapsed * 1000:.0f} ms")
+        return _PooledConnection(connection)
+
+    def _checkin(self, pooled, broken):
+        now = time.monotonic()
+        pooled.last_used = now
+        expired = now - pooled.created > self.max_lifetime
+        if broken or expired:
+            self._close_quietly(pooled)
+            with self.lock:
+                self.open -= 1
+                if broken:
+                    self.discarded += 1
+                else:
+                    self.evicted += 1
+                self.available.notify()
+            return
+        with self.lock:
+            self.idle.append(pooled)
+            self.available.notify()
+
+    def _evict_idle(self):
+        # Holds self.lock; the least recently used connections are at the front
+        now = time.monotonic()
+        while self.idle and (now - self.idle[0].last_used > self.max_idle or
+                             now - self.idle[0].created > self.max_lifetime):
+            pooled = self.idle.pop(0)
+            self.open -= 1
+            self.evicted += 1
+            self._close_quietly(pooled)
+
+    def _close_quietly(self, pooled):
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+            self.open -= len(idle)
+        for pooled in idle:
+            self._close_quietly(pooled)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': self.size,
+                'open': self.open,
+                'idle': len(self.idle),
+                'in_use': self.open - len(self.idle),
+                'logons': self.logons,
+                'avg_logon_ms': self.logon_time / self.logons * 1000 if self.logons else 0.0,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'avg_wait_ms': self.wait_time / self.waits * 1000 if self.waits else 0.0,
+                'max_wait_ms': self.max_wait * 1000,
+                'timeouts': self.timeouts,
+                'discarded': self.discarded,
+                'evicted': self.evicted,
+                'failed_health_checks': self.failed_checks,
+            }
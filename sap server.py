@@ -1,12 +1,16 @@
-from flask import Flask, render_template, request, jsonify
-from pyrfc import Connection
+from flask import Flask, render_template, request, jsonify, json as flask_json
+from pyrfc import Connection, CommunicationError, ABAPApplicationError, ABAPRuntimeError, ExternalRuntimeError
 from mysql.connector import pooling, Error as MySQLError
 from datetime import datetime
-import threading
 import logging
 import traceback
 import time
 import redis
+from rfcpool import RfcConnectionPool, PoolTimeout
+from sapgate import SapCallGate, BoundedExecutor, Overloaded
+from bomcache import BomCache
+from bomexplode import BomExplosion
+from singleflight import SingleFlight
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'  # Change this to a secure key
@@ -30,12 +34,59 @@ MYSQL_CONN_PARAMS = {
     "pool_size": 10
 }
 
+# SAP RFC connection pool: connections are logged on once and reused by every SAP call
+SAP_POOL_SIZE = 8
+SAP_POOL_TIMEOUT = 30         # Seconds to wait for a free connection
+SAP_POOL_MAX_IDLE = 300       # Seconds before an unused connection is closed
+SAP_POOL_MAX_LIFETIME = 3600  # Seconds before a connection is replaced
+SAP_POOL_CHECK_AFTER = 60     # Idle seconds after which a connection is pinged before use
+
+rfc_pool = RfcConnectionPool(lambda: Connection(**SAP_CONN_PARAMS), size=SAP_POOL_SIZE,
+                             timeout=SAP_POOL_TIMEOUT, max_idle=SAP_POOL_MAX_IDLE,
+                             max_lifetime=SAP_POOL_MAX_LIFETIME, check_after=SAP_POOL_CHECK_AFTER,
+                             discard_on=(CommunicationError, ABAPRuntimeError, ExternalRuntimeError))
+
+# Back-pressure: every SAP call takes a slot of the gate, and the BOM levels of all
+# requests are fetched on one bounded worker pool. Saturation is answered with 503 + Retry-After.
+SAP_MAX_IN_FLIGHT = SAP_POOL_SIZE
+SAP_CALL_WAIT = 15         # Seconds a call may queue for a slot before the request is refused
+SAP_RETRY_AFTER = 5        # Seconds suggested to refused clients
+BOM_WORKERS = 16
+BOM_MAX_PENDING = 256      # BOM levels being fetched or queued, over all requests
+BOM_BATCH_SIZE = 64        # BOM levels one request submits at a time
+BOM_REQUEST_TIMEOUT = 60   # Seconds one request may spend on its components
+
+sap_gate = SapCallGate(SAP_MAX_IN_FLIGHT, wait=SAP_CALL_WAIT, retry_after=SAP_RETRY_AFTER)
+bom_executor = BoundedExecutor(BOM_WORKERS, BOM_MAX_PENDING, retry_after=SAP_RETRY_AFTER, name='bom')
+
+# Request coalescing: scans of the same car at several stations share one MySQL -> BAPI -> BOM
+# run, and concurrent misses of the same BOM level share one RFC call
+SINGLE_FLIGHT_ACROSS_PROCESSES = True  # Also coalesce between server processes through a Redis lock
+SINGLE_FLIGHT_RESULT_TTL = 30          # Seconds a published result stays readable for other processes
+
 # MySQL connection pool
 mysql_pool = pooling.MySQLConnectionPool(**MYSQL_CONN_PARAMS)
 
 # Redis connection
 redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
 
+# BOM explosion parameters and the cache of exploded levels
+BOM_STLAN = "3"
+BOM_STLAL = "1"
+BOM_CACHE_SIZE = 20000  # Levels kept in process, in front of Redis
+BOM_NOT_FOUND = ("NO_BOM_FOUND", "NO_SUITABLE_BOM_FOUND")  # Cached as an empty level
+BOM_MAX_DEPTH = 10      # Levels below a JIT component that are exploded
+BOM_EXPAND_PREFIXES = ("P", "B")  # Components that are sub-assemblies with a BOM of their own
+
+bom_cache = BomCache(redis_client, max_entries=BOM_CACHE_SIZE)
+
+flight_redis = redis_client if SINGLE_FLIGHT_ACROSS_PROCESSES else None
+prodn_flight = SingleFlight('prodn', flight_redis, lock_timeout=BOM_REQUEST_TIMEOUT + 30,
+                            wait_timeout=BOM_REQUEST_TIMEOUT + 30, result_ttl=SINGLE_FLIGHT_RESULT_TTL,
+                            dumps=flask_json.dumps, loads=flask_json.loads)
+bom_flight = SingleFlight('bom', flight_redis, lock_timeout=SAP_CALL_WAIT + 60,
+                          wait_timeout=SAP_CALL_WAIT + 60, result_ttl=SINGLE_FLIGHT_RESULT_TTL)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
@@ -82,57 +133,81 @@ def fetch_jinum_from_mysql(prodn):
         logging.error(f"Failed to fetch JINUM from MySQL: {err}")
         return None
 
+# Every RFC goes through the gate, then the connection pool
+def sap_call(function, **parameters):
+    with sap_gate.slot():
+        return rfc_pool.call(function, **parameters)
+
 def call_bapi_get_details(jinum):
     try:
-        conn_sap = Connection(**SAP_CONN_PARAMS)
         jitcalls = [{'JITCALLNUMBER': jinum}]
-        result = conn_sap.call('BAPI_JITCALLIN_GETDETAILS', JITCALLS=jitcalls)
-        conn_sap.close()
+        result = sap_call('BAPI_JITCALLIN_GETDETAILS', JITCALLS=jitcalls)
 
         return result['JITCALLCOMPONENTS']
 
+    except (Overloaded, PoolTimeout):
+        raise
     except Exception as e:
         logging.error(f"Failed to call BAPI_JITCALLIN_GETDETAILS: {e}")
         return None
 
-def fetch_bom_data(material, werks):
+# One level of the BOM of a material, from the cache or from SAP
+def fetch_bom_level(material, werks, datuv=None):
+    datuv = datuv or datetime.today().date()
+    key = bom_cache.key(material, werks, BOM_STLAN, BOM_STLAL, datuv)
+    level = bom_cache.get(key)
+    if level is not None:
+        return level
+    return list(bom_flight.do(key, load_bom_level, material, werks, datuv, key))
+
+def load_bom_level(material, werks, datuv, key):
+    token = bom_cache.load_token()  # An invalidation during the call keeps the result out of the cache
     try:
-        conn_sap = Connection(**SAP_CONN_PARAMS)
-        datuv = datetime.today().date()
-        stlan = "3"
-
-        bom_data = conn_sap.call("CS_BOM_EXPL_MAT_V2_RFC", 
-                             DATUV=datuv,
-                             MTNRV=material,
-                             WERKS=werks,
-                             STLAN=stlan,
-                             CAPID="",
-                             AUMNG="0",
-                             EMENG="0",
-                             MKTLS="x",
-                             STPST="0",
-                             SVWVO="x",
-                             VRSVO="x",
-                             STLAL="1")
-
-        conn_sap.close()
-        processed_bom_data = process_bom_data(bom_data)
-
-        bom_materials = {item["Material"] for item in processed_bom_data if item["Material"].startswith(("P", "B"))}
-        nested_bom_data = []
-        for material in bom_materials:
-            nested_data = fetch_bom_data(material, werks)
-            if nested_data:
-                nested_bom_data.extend(nested_data)
-
-        processed_bom_data.extend(nested_bom_data)
-        return processed_bom_data
-
+        bom_data = sap_call("CS_BOM_EXPL_MAT_V2_RFC",
+                            DATUV=datuv,
+                            MTNRV=material,
+                            WERKS=werks,
+                            STLAN=BOM_STLAN,
+                            CAPID="",
+                            AUMNG="0",
+                            EMENG="0",
+                            MKTLS="x",
+                            STPST="0",
+                            SVWVO="x",
+                            VRSVO="x",
+                            STLAL=BOM_STLAL)
+    except ABAPApplicationError as e:
+        if e.key not in BOM_NOT_FOUND:
+            raise
+        bom_data = {}
+
+    level = process_bom_data(bom_data)
+    bom_cache.put(key, level, token)
+    return level
+
+# A level that cannot be fetched counts as empty, the rest of the explosion goes on
+def fetch_bom_level_or_empty(material, werks):
+    try:
+        return fetch_bom_level(material, werks)
+    except (Overloaded, PoolTimeout):
+        raise
     except Exception as e:
         logging.error(f"Failed to fetch BOM data for Material {material}: {e}")
         logging.error(traceback.format_exc())
         return []
 
+# Explode the BOMs of several materials together, each sub-assembly only once
+def explode_boms(materials, werks):
+    explosion = BomExplosion(fetch_bom_level_or_empty, bom_executor.run_all, werks,
+                             max_depth=BOM_MAX_DEPTH, batch_size=BOM_BATCH_SIZE,
+                             expandable=lambda item: item["Material"].startswith(BOM_EXPAND_PREFIXES))
+    explosion.explode(materials, timeout=BOM_REQUEST_TIMEOUT)
+    logging.info(f"Exploded {len(materials)} materials: {explosion.fetches} levels, {explosion.depth} deep")
+    return explosion
+
+def fetch_bom_data(material, werks):
+    return explode_boms([material], werks).result(material)
+
 def process_bom_data(bom_data):
     try:
         items = bom_data.get("STB", [])
@@ -151,18 +226,68 @@ def process_bom_data(bom_data):
         logging.error(traceback.format_exc())
         return []
 
-def fetch_bom_data_concurrently(material, werks, results, index):
-    try:
-        bom_data = fetch_bom_data(material, werks)
-        results[index] = bom_data
-    except Exception as e:
-        logging.error(f"Error in concurrent BOM data fetch for material {material}: {e}")
+# Flattened BOM of every JIT component, exploded level by level on the shared worker pool
+def fetch_components_bom(jitcalcomponents, werks):
+    materials = [component['MATERIAL'] for component in jitcalcomponents]
+    explosion = explode_boms(materials, werks)
+    return [explosion.result(material) for material in materials]
+
+# The whole pipeline for one PRODN; concurrent calls for the same PRODN share one run
+def fetch_prodn_boms(prodn):
+    return prodn_flight.do(prodn, load_prodn_boms, prodn)
+
+def load_prodn_boms(prodn):
+    jinum = fetch_jinum_from_mysql(prodn)
+    if not jinum:
+        return {'error': f'Could not find JINUM for PRODN: {prodn}'}
+
+    jitcalcomponents = call_bapi_get_details(jinum)
+    if not jitcalcomponents:
+        return {'error': f'No JIT Call Components found for JINUM: {jinum}'}
+
+    werks = "TN30" if prodn.startswith("52") else "TN10"
+    logging.info(f"Value of werks: {werks}")
+
+    return {'components': jitcalcomponents, 'boms': fetch_components_bom(jitcalcomponents, werks)}
+
+@app.errorhandler(Overloaded)
+@app.errorhandler(PoolTimeout)
+def sap_overloaded(e):
+    retry_after = getattr(e, 'retry_after', SAP_RETRY_AFTER)
+    logging.warning(f"Refusing request, SAP is saturated: {e}")
+    response = jsonify({'error': 'SAP is busy, please retry shortly.', 'retry_after': retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
 
 @app.route('/')
 def index():
     sap_system = identify_sap_system()
     return render_template('index1.html', sap_system=sap_system)
 
+# Connection pool, back-pressure, BOM cache and request coalescing figures
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({'sap_pool': rfc_pool.stats(), 'sap_gate': sap_gate.stats(),
+                    'bom_workers': bom_executor.stats(), 'bom_cache': bom_cache.stats(),
+                    'single_flight': {'prodn': prodn_flight.stats(), 'bom': bom_flight.stats()}}), 200
+
+# Drop cached BOM levels after a BOM change in SAP; no parameters clears everything
+@app.route('/admin/bom_cache/invalidate', methods=['POST'])
+def invalidate_bom_cache():
+    data = request.get_json(silent=True)
+    if data is None:
+        data = request.form
+    elif not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    material, werks = data.get('material') or '', data.get('werks') or ''
+    if not isinstance(material, str) or not isinstance(werks, str):
+        return jsonify({'error': 'material and werks must be strings'}), 400
+    material = material.strip().lstrip('0') or None
+    werks = werks.strip() or None
+    removed = bom_cache.invalidate(material=material, werks=werks)
+    return jsonify({'message': 'BOM cache invalidated', 'material': material, 'werks': werks,
+                    'removed': removed}), 200
+
 @app.route('/fetch_jit_components', methods=['POST'])
 def fetch_jit_components():
     start_time = time.time()
@@ -171,29 +296,11 @@ def fetch_jit_components():
     if not prodn:
         return jsonify({'error': 'Please enter a PRODN value.'}), 400
 
-    jinum = fetch_jinum_from_mysql(prodn)
-    if not jinum:
-        return jsonify({'error': f'Could not find JINUM for PRODN: {prodn}'}), 404
-
-    jitcalcomponents = call_bapi_get_details(jinum)
-    if not jitcalcomponents:
-        return jsonify({'error': f'No JIT Call Components found for JINUM: {jinum}'}), 404
-
-    werks = "TN30" if prodn.startswith("52") else "TN10"
-    logging.info(f"Value of werks: {werks}")
-
-    threads = []
-    results = [None] * len(jitcalcomponents)
-    for i, component in enumerate(jitcalcomponents):
-        material = component['MATERIAL']
-        thread = threading.Thread(target=fetch_bom_data_concurrently, args=(material, werks, results, i))
-        threads.append(thread)
-        thread.start()
+    boms = fetch_prodn_boms(prodn)
+    if 'error' in boms:
+        return jsonify({'error': boms['error']}), 404
 
-    for thread in threads:
-        thread.join()
-
-    response = [{'component': component, 'bom_data': results[i]} for i, component in enumerate(jitcalcomponents)]
+    response = [{'component': component, 'bom_data': bom_data} for component, bom_data in zip(boms['components'], boms['boms'])]
 
     execution_time = time.time() - start_time
     return jsonify({'results': response, 'execution_time': execution_time}), 200
@@ -206,29 +313,11 @@ def fetch_jit_components_api():
     if not prodn:
         return jsonify({'error': 'Please provide a PRODN parameter.'}), 400
 
-    jinum = fetch_jinum_from_mysql(prodn)
-    if not jinum:
-        return jsonify({'error': f'Could not find JINUM for PRODN: {prodn}'}), 404
-
-    jitcalcomponents = call_bapi_get_details(jinum)
-    if not jitcalcomponents:
-        return jsonify({'error': f'No JIT Call Components found for JINUM: {jinum}'}), 404
-
-    werks = "TN30" if prodn.startswith("52") else "TN10"
-    logging.info(f"Value of werks: {werks}")
-
-    threads = []
-    results = [None] * len(jitcalcomponents)
-    for i, component in enumerate(jitcalcomponents):
-        material = component['MATERIAL']
-        thread = threading.Thread(target=fetch_bom_data_concurrently, args=(material, werks, results, i))
-        threads.append(thread)
-        thread.start()
-
-    for thread in threads:
-        thread.join()
+    boms = fetch_prodn_boms(prodn)
+    if 'error' in boms:
+        return jsonify({'error': boms['error']}), 404
 
-    response = [{'CUST_MAT': component.get('CUST_MAT', ''), 'BOM': results[i] if results[i] else []} for i, component in enumerate(jitcalcomponents)]
+    response = [{'CUST_MAT': component.get('CUST_MAT', ''), 'BOM': bom_data if bom_data else []} for component, bom_data in zip(boms['components'], boms['boms'])]
 
     execution_time = time.time() - start_time
     return jsonify({'results': response, 'execution_time': execution_time}), 200
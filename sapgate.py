@@ -0,0 +1,156 @@
+import logging
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """The server is saturated; the caller should retry after retry_after seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SapCallGate:
+    """Global cap on SAP calls in flight, shared by every request and worker thread.
+
+    A caller waits up to `wait` seconds for a slot and gets Overloaded after
+    that, so a burst queues for a while and is then turned away instead of
+    piling more calls onto the SAP gateway.
+    """
+
+    def __init__(self, limit, wait=15.0, retry_after=5):
+        self.limit = limit
+        self.wait = wait
+        self.retry_after = retry_after
+        self.semaphore = threading.BoundedSemaphore(limit)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        # Metrics
+        self.calls = 0
+        self.queued = 0
+        self.rejected = 0
+        self.max_in_flight = 0
+        self.max_waiting = 0
+
+    @contextmanager
+    def slot(self):
+        if not self.semaphore.acquire(blocking=False):
+            with self.lock:
+                self.queued += 1
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                acquired = self.semaphore.acquire(timeout=self.wait)
+            finally:
+                with self.lock:
+                    self.waiting -= 1
+            if not acquired:
+                with self.lock:
+                    self.rejected += 1
+                raise Overloaded(f"{self.limit} SAP calls in flight for more than {self.wait:.0f} s",
+                                 self.retry_after)
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            self.semaphore.release()
+
+    def call(self, function, *args, **kwargs):
+        with self.slot():
+            return function(*args, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'calls': self.calls,
+                'queued': self.queued,
+                'rejected': self.rejected,
+                'max_in_flight': self.max_in_flight,
+                'max_waiting': self.max_waiting,
+            }
+
+
+class BoundedExecutor:
+    """Shared worker pool with a cap on the tasks it holds (running plus queued).
+
+    run_all() admits all tasks of a request or none of them, so a request is
+    either served in full or refused with Overloaded straight away.
+    """
+
+    def __init__(self, workers, max_pending, retry_after=5, name='worker'):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.lock = threading.Lock()
+        self.pending = 0
+        # Metrics
+        self.batches = 0
+        self.tasks = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.max_pending_seen = 0
+
+    def run_all(self, function, arguments, timeout=None):
+        """Run function(*args) for every tuple in arguments; return the results in order."""
+        arguments = list(arguments)
+        with self.lock:
+            if self.pending + len(arguments) > self.max_pending:
+                self.rejected += 1
+                raise Overloaded(f"{self.pending} tasks already pending (limit {self.max_pending})",
+                                 self.retry_after)
+            self.pending += len(arguments)
+            self.max_pending_seen = max(self.max_pending_seen, self.pending)
+            self.batches += 1
+            self.tasks += len(arguments)
+
+        futures = []
+        for args in arguments:
+            future = self.executor.submit(function, *args)
+            future.add_done_callback(self._task_done)
+            futures.append(future)
+
+        done, not_done = wait(futures, timeout=timeout, return_when=FIRST_EXCEPTION)
+        for future in done:
+            if future.exception() is not None:
+                for other in not_done:
+                    other.cancel()
+                raise future.exception()
+        if not_done:
+            for future in not_done:
+                future.cancel()
+            with self.lock:
+                self.timeouts += 1
+            logging.warning(f"{len(not_done)} of {len(futures)} tasks unfinished after {timeout} s")
+            raise Overloaded(f"Request not finished within {timeout} s",
+                             max(self.retry_after, math.ceil(timeout / 2)))
+        return [future.result() for future in futures]
+
+    def _task_done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                'max_pending_seen': self.max_pending_seen,
+                'batches': self.batches,
+                'tasks': self.tasks,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+            }
@@ -0,0 +1,81 @@
+import time
+
+from mcp23s17 import IOCON, IODIRA, IODIRB, GPIOA, GPIOB, OLATA, OLATB, PORT_A, PORT_B
+
+# Power-on self-test of the LED outputs. Every LED of a chip is lit with one
+# write per port, then latches, pin levels and configuration are read back, so
+# a rack is checked in a few SPI transfers instead of a one-by-one sweep.
+
+
+def _pair(values):
+    return values[PORT_A] | values[PORT_B] << 8
+
+
+def mcp_self_test(bus, led_masks, iocon_bits=0x00, hold=0.0):
+    """Check every chip of an MCP23S17Bus; returns {'ok', 'elapsed_ms', 'chips': [...]}.
+
+    led_masks maps (chip, port) to the LED outputs (PinMap.led_masks).
+    iocon_bits must be set in each chip's IOCON (e.g. HAEN, MIRROR|ODR).
+    The LEDs stay lit for `hold` seconds, then the latches go back to what
+    they were. One entry per chip: {'chip', 'address', 'ok', 'errors', ...}.
+    """
+    start = time.perf_counter()
+    chips = range(bus.chip_count)
+    outputs = [_pair([led_masks.get((chip, port), 0) for port in (PORT_A, PORT_B)]) for chip in chips]
+    with bus.lock:
+        saved = [list(bus.latches[chip]) for chip in chips]
+        lit = []
+        for chip in chips:
+            active_low = _pair(bus.active_low[chip])
+            lit.append((outputs[chip] ^ active_low) | (_pair(saved[chip]) & ~outputs[chip]))
+            # Queued when the SPI worker runs: all chips are written before the first read waits
+            for port in (PORT_A, PORT_B):
+                if lit[chip] >> (8 * port) & 0xFF != saved[chip][port]:
+                    bus.write_latch(chip, port, lit[chip] >> (8 * port) & 0xFF)
+
+        results = []
+        for chip in chips:
+            errors = []
+            # Two bursts per chip: IODIRA..IOCON, then GPIOA..OLATB
+            config = bus.read_registers(chip, IODIRA, IOCON - IODIRA + 1)
+            iocon, iodir = config[IOCON], config[IODIRA] | config[IODIRB] << 8
+            latches = bus.read_registers(chip, GPIOA, OLATB - GPIOA + 1)
+            levels = latches[0] | latches[GPIOB - GPIOA] << 8
+            olat = latches[OLATA - GPIOA] | latches[OLATB - GPIOA] << 8
+            if iocon & iocon_bits != iocon_bits:
+                errors.append(f"IOCON is {iocon:#04x}, expected bits {iocon_bits:#04x}")
+            if iodir & outputs[chip]:
+                errors.append(f"IODIR is {iodir:#06x}, LED outputs {outputs[chip]:#06x} are inputs")
+            if olat != lit[chip]:
+                errors.append(f"OLAT read back {olat:#06x}, wrote {lit[chip]:#06x}")
+            elif (levels ^ olat) & outputs[chip]:
+                errors.append(f"LED pins {(levels ^ olat) & outputs[chip]:#06x} do not follow the latch")
+            results.append({'chip': chip, 'address': bus.addresses[chip], 'ok': not errors, 'errors': errors,
+                            'leds': bin(outputs[chip]).count('1'), 'iocon': iocon, 'iodir': iodir, 'olat': olat})
+
+        if hold:
+            time.sleep(hold)
+        for chip in chips:
+            for port in (PORT_A, PORT_B):
+                if bus.latches[chip][port] != saved[chip][port]:
+                    bus.write_latch(chip, port, saved[chip][port])
+        bus.flush()
+    return {'ok': all(r['ok'] for r in results), 'elapsed_ms': round((time.perf_counter() - start) * 1000, 3),
+            'chips': results}
+
+
+def gpio_self_test(gpio, led_pins, hold=0.0):
+    """Light every LED on a Pi GPIO pin at once and read the pins back; returns {'ok', 'elapsed_ms', 'pins'}."""
+    start = time.perf_counter()
+    failed = []
+    for pin in led_pins:
+        gpio.output(pin, gpio.HIGH)
+    for pin in led_pins:
+        if gpio.input(pin) != gpio.HIGH:
+            failed.append(pin)
+    if hold:
+        time.sleep(hold)
+    for pin in led_pins:
+        gpio.output(pin, gpio.LOW)
+    return {'ok': not failed, 'elapsed_ms': round((time.perf_counter() - start) * 1000, 3),
+            'pins': len(led_pins), 'failed_pins': failed}
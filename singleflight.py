@@ -0,0 +1,146 @@
+import json
+import logging
+import threading
+import time
+import uuid
+
+import redis
+
+# Delete the lock only if it still belongs to this leader
+RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution of the function.
+
+    Within a process the first caller runs the function and the others wait
+    for its result (or its exception). With a redis_client the leader also
+    takes a Redis lock (SET NX with a timeout), so leaders in other server
+    processes wait for the result it publishes for result_ttl seconds
+    instead of computing it again. Results must survive dumps()/loads().
+    If a follower waits longer than wait_timeout, or the remote leader
+    disappears without a result, or Redis is unreachable, the caller simply
+    runs the function itself.
+    """
+
+    def __init__(self, name, redis_client=None, lock_timeout=90.0, wait_timeout=90.0, result_ttl=30,
+                 poll_interval=0.05, dumps=json.dumps, loads=json.loads):
+        self.name = name
+        self.redis = redis_client
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.dumps = dumps
+        self.loads = loads
+        self.lock = threading.Lock()
+        self.calls = {}
+        # Metrics
+        self.leaders = 0
+        self.shared = 0
+        self.remote_shared = 0
+        self.fallbacks = 0
+
+    def do(self, key, function, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            if call.done.wait(self.wait_timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            logging.warning(f"Waited {self.wait_timeout:.0f} s for {self.name} {key}, running it here")
+            with self.lock:
+                self.fallbacks += 1
+            return function(*args)
+
+        try:
+            call.result = self._run(key, function, args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def _run(self, key, function, args):
+        if self.redis is None:
+            return function(*args)
+
+        lock_key = f"flight:{self.name}:{'|'.join(map(str, key)) if isinstance(key, tuple) else key}"
+        token = uuid.uuid4().hex
+        try:
+            acquired = self.redis.set(lock_key, token, nx=True, px=int(self.lock_timeout * 1000))
+        except redis.RedisError as e:
+            logging.warning(f"Single-flight lock for {self.name} {key} unavailable: {e}")
+            return function(*args)
+        if not acquired:
+            return self._wait_remote(lock_key, key, function, args)
+
+        try:
+            result = function(*args)
+            try:
+                self.redis.setex(f"{lock_key}:{token}", self.result_ttl, self.dumps(result))
+            except (redis.RedisError, TypeError, ValueError) as e:
+                logging.warning(f"Could not publish the {self.name} result for {key}: {e}")
+            return result
+        finally:
+            try:
+                self.redis.eval(RELEASE_LOCK, 1, lock_key, token)
+            except redis.RedisError:
+                pass  # The lock times out on its own
+
+    def _wait_remote(self, lock_key, key, function, args):
+        # Another process is computing it: poll for the result published under its token
+        deadline = time.monotonic() + self.wait_timeout
+        owner = None
+        try:
+            while time.monotonic() < deadline:
+                current = self.redis.get(lock_key)
+                if current is not None:
+                    owner = current.decode()
+                if owner is not None:
+                    cached = self.redis.get(f"{lock_key}:{owner}")
+                    if cached is not None:
+                        with self.lock:
+                            self.remote_shared += 1
+                        return self.loads(cached)
+                if current is None:
+                    break  # The leader finished or gave up without a result
+                time.sleep(self.poll_interval)
+        except redis.RedisError as e:
+            logging.warning(f"Lost Redis while waiting for {self.name} {key}: {e}")
+        with self.lock:
+            self.fallbacks += 1
+        return function(*args)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'in_flight': len(self.calls),
+                'leaders': self.leaders,
+                'shared': self.shared,
+                'remote_shared': self.remote_shared,
+                'fallbacks': self.fallbacks,
+            }
@@ -0,0 +1,92 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+# Upper bound on the operations merged into one pass of the worker
+MAX_BATCH = 256
+
+
+class SpiCommandQueue:
+    """A single worker thread that owns the SPI device; other threads submit operations.
+
+    transfer(chip, data) performs the actual SPI transaction and is only ever
+    called from the worker. Writes submitted with a key are coalesced: when
+    several writes to the same (chip, key) are waiting, the last one's data is
+    sent in the place of the first, unless another transfer to that chip or a
+    flush() sits between them.
+    """
+
+    def __init__(self, transfer):
+        self._transfer = transfer
+        self.ops = queue.Queue()
+        self.sent = 0
+        self.coalesced = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def in_worker(self):
+        return threading.current_thread() is self._thread
+
+    def submit(self, chip, data, key=None):
+        """Queue a transfer; the future resolves to the bytes clocked back."""
+        future = Future()
+        self.ops.put((chip, list(data), key, [future]))
+        return future
+
+    def flush(self):
+        """Wait until everything submitted so far has been sent."""
+        self.submit(None, []).result()
+
+    def _run(self):
+        while True:
+            batch = [self.ops.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.ops.get_nowait())
+                except queue.Empty:
+                    break
+            for chip, data, key, futures in self._coalesce(batch):
+                if chip is None:
+                    result = []
+                else:
+                    try:
+                        result = self._transfer(chip, data)
+                        self.sent += 1
+                    except Exception as e:
+                        print(f"SPI transfer to chip {chip} failed: {e}")
+                        for future in futures:
+                            future.set_exception(e)
+                        continue
+                for future in futures:
+                    future.set_result(result)
+
+    def _coalesce(self, batch):
+        pending = {}  # (chip, key) -> index in ops of the write still to be sent
+        ops = []
+        for chip, data, key, futures in batch:
+            if chip is None:
+                # A flush marker is a barrier for every chip
+                pending.clear()
+                ops.append((chip, data, key, futures))
+                continue
+            if key is None:
+                # Reads and raw transfers are barriers for their chip
+                for pending_key in [k for k in pending if k[0] == chip]:
+                    del pending[pending_key]
+                ops.append((chip, data, key, futures))
+                continue
+            index = pending.get((chip, key))
+            if index is not None:
+                # A newer write to the same register replaces the queued one in its place,
+                # so it is not moved past anything queued for the chip in between
+                superseded = ops[index]
+                ops[index] = (chip, data, key, superseded[3] + futures)
+                self.coalesced += 1
+                continue
+            pending[(chip, key)] = len(ops)
+            ops.append((chip, data, key, futures))
+        return ops